@@ -0,0 +1,351 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+
+import new
+
+# --- 被测引擎：new.py 命令行版与 300.替换CLINE.py 图形界面版 ---
+
+_GUI_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "300.替换CLINE.py")
+
+
+def load_gui_module():
+    """按文件路径导入 300.替换CLINE.py（文件名不是合法的模块名）；没有 tkinter 时返回 None。"""
+    spec = importlib.util.spec_from_file_location("code_modifier_gui", _GUI_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except ImportError:
+        return None
+    return module
+
+
+class _HeadlessText:
+    """代替 Tk 文本框的最小实现，只提供 process_replacements 用到的方法，使其不创建窗口也能运行。"""
+
+    def __init__(self, text=""):
+        self.chunks = [text]
+
+    def get(self, start, end):
+        text = "".join(self.chunks)
+        # Tk 的 get("1.0", END) 结果末尾总带一个换行，"end-1c" 则不带
+        return text if end == "end-1c" else text + "\n"
+
+    def insert(self, index, text):
+        self.chunks.append(text)
+
+    def delete(self, start, end):
+        self.chunks = []
+
+    def config(self, **options):
+        pass
+
+    def see(self, index):
+        pass
+
+    def after_idle(self, callback):
+        pass
+
+    def redraw(self, *args):
+        pass
+
+
+def run_cli(commands_str_raw, original_code):
+    """用 new.py 的引擎处理，返回修改后的代码。日志级别为 off，只计引擎本身的耗时。"""
+    return new.process_code_modifications_cli(commands_str_raw, original_code, log_level="off")["modified_code"]
+
+
+def make_headless_app(gui_module, commands_str_raw="", original_code=""):
+    """不调用 __init__（不建窗口）创建 CodeModifierApp，文本框换成 _HeadlessText，其非界面方法可直接调用。"""
+    app = gui_module.CodeModifierApp.__new__(gui_module.CodeModifierApp)
+    app.command_text = _HeadlessText(commands_str_raw)
+    app.original_code_text = _HeadlessText(original_code)
+    app.modified_code_text = _HeadlessText()
+    app.modified_line_numbers = _HeadlessText()
+    app.log_text = _HeadlessText()
+    return app
+
+
+def make_gui_runner(gui_module):
+    """返回用 CodeModifierApp.process_replacements 处理的函数（见 make_headless_app）。"""
+    def run_gui(commands_str_raw, original_code):
+        app = make_headless_app(gui_module, commands_str_raw, original_code)
+        app.process_replacements()
+        return app.modified_code_text.get("1.0", "end-1c")
+    return run_gui
+
+
+def available_engines():
+    """名称 -> 处理函数 (commands, original_code) -> modified_code。"""
+    engines = {"cli": run_cli}
+    gui_module = load_gui_module()
+    if gui_module is None:
+        print("提示: 无法导入 tkinter，跳过图形界面版引擎 (gui)。", file=sys.stderr)
+    else:
+        engines["gui"] = make_gui_runner(gui_module)
+    return engines
+
+
+# --- 生成的工作负载 ---
+
+def format_commands(pairs):
+    return "".join(f"search:《{search_val}》\nreplace:《{replace_val}》\n" for search_val, replace_val in pairs)
+
+
+def _code_line(i):
+    return f"    value_{i} = compute({i}, 'item_{i}')"
+
+
+def _spread(line_count, pair_count):
+    """从 line_count 行中均匀挑出 pair_count 个互不相邻的起始行，保证各替换对的 search 块互不重叠。"""
+    step = max(2, line_count // max(pair_count, 1))
+    return list(range(0, line_count - 1, step))[:pair_count]
+
+
+def workload_exact(line_count, pair_count, newline="\n"):
+    """每个替换对都能精确匹配一行（只走第1轮）。"""
+    code = newline.join(_code_line(i) for i in range(line_count)) + newline
+    pairs = [(_code_line(i).strip(), _code_line(i).strip() + " + 1") for i in _spread(line_count, pair_count)]
+    return format_commands(pairs), code
+
+
+def workload_whitespace(line_count, pair_count, newline="\n"):
+    """原文的空白与 search 不同，每个替换对都要走第2轮宽松匹配（两行的 search 块，重新缩进的两行 replace 块）。"""
+    code = newline.join(_code_line(i).replace(" = ", "  =  ") for i in range(line_count)) + newline
+    pairs = [(f"{_code_line(i).strip()}\n{_code_line(i + 1).strip()}",
+              f"if ready_{i}:\n    {_code_line(i).strip()}")
+             for i in _spread(line_count, pair_count)]
+    return format_commands(pairs), code
+
+
+def workload_crlf(line_count, pair_count):
+    """CRLF 换行的文件，精确匹配与宽松匹配的替换对各占一半。"""
+    exact_commands, code = workload_exact(line_count, (pair_count + 1) // 2, newline="\r\n")
+    lines = code.split("\r\n")
+    pairs = []
+    for i in _spread(line_count, pair_count)[1::2]:
+        lines[i] = lines[i].replace(" = ", "  =  ")
+        pairs.append((f"{_code_line(i).strip()}\n{_code_line(i + 1).strip()}", f"# moved {i}\n{_code_line(i).strip()}"))
+    return exact_commands + format_commands(pairs), "\r\n".join(lines)
+
+
+def workload_minified(line_count, pair_count):
+    """压缩成一行的文件（line_count 条语句），替换对精确匹配行内片段。"""
+    code = "".join(f"value_{i}=compute({i});" for i in range(line_count)) + "\n"
+    pairs = [(f"value_{i}=compute({i});", f"value_{i}=compute({i})+1;") for i in _spread(line_count, pair_count)]
+    return format_commands(pairs), code
+
+
+def workload_round_2_worst(line_count, pair_count):
+    """第2轮的最坏情况：每一行都等于 search 首行（都是锚点），而 search 块直到最后一行才不匹配，
+    且精确匹配全部失败，所有替换对都在整个文件上走完第2轮。"""
+    code = "\n".join("    x  =  1" for _ in range(line_count)) + "\n"
+    search_line_count = min(50, line_count)
+    pairs = [("x = 1\n" * (search_line_count - 1) + f"y = {i}", f"z = {i}") for i in range(pair_count)]
+    return format_commands(pairs), code
+
+
+_WORKLOAD_KINDS = {
+    "exact": workload_exact,
+    "whitespace": workload_whitespace,
+    "crlf": workload_crlf,
+    "minified": workload_minified,
+    "round2_worst": workload_round_2_worst,
+}
+
+# (类型, 行数, 替换对数)。宽松匹配每次命中都会修改文档并重建规范化行索引，
+# 代价约为 行数 × 替换对数，因此大文件只配较少的替换对，保证整套基准在几分钟内完成。
+DEFAULT_MATRIX = [
+    *(("exact", lines, pairs) for lines in (1_000, 10_000, 100_000) for pairs in (1, 10, 100, 1000)),
+    *(("whitespace", lines, pairs) for lines, pairs in ((1_000, 1), (1_000, 10), (1_000, 100), (1_000, 1000),
+                                                        (10_000, 1), (10_000, 10), (10_000, 100), (100_000, 1),
+                                                        (100_000, 10))),
+    *(("crlf", lines, pairs) for lines, pairs in ((1_000, 10), (10_000, 10), (10_000, 100), (100_000, 10))),
+    *(("minified", lines, pairs) for lines in (1_000, 10_000, 100_000) for pairs in (1, 100, 1000)),
+    *(("round2_worst", lines, pairs) for lines, pairs in ((1_000, 1), (1_000, 100), (10_000, 10), (100_000, 1))),
+]
+
+
+def workload_name(kind, line_count, pair_count):
+    return f"{kind}/{line_count}l/{pair_count}p"
+
+
+# --- 运行与比较 ---
+
+def time_call(function, args, repeat):
+    """调用 function(*args) repeat 次，返回 (每次耗时列表, 最后一次的返回值)。"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started_at)
+    return timings, result
+
+
+def run_benchmarks(engines, matrix, repeat, name_filter=None, progress=None):
+    results = []
+    for kind, line_count, pair_count in matrix:
+        name = workload_name(kind, line_count, pair_count)
+        if name_filter and not re.search(name_filter, name):
+            continue
+        commands_str_raw, original_code = _WORKLOAD_KINDS[kind](line_count, pair_count)
+        for engine_name, engine in engines.items():
+            timings, _ = time_call(engine, (commands_str_raw, original_code), repeat)
+            result = {"workload": name, "engine": engine_name, "kind": kind, "lines": line_count, "pairs": pair_count,
+                      "input_size": len(original_code), "repeat": repeat,
+                      "min_seconds": min(timings), "median_seconds": statistics.median(timings)}
+            results.append(result)
+            if progress:
+                progress(result)
+    return results
+
+
+# --- 回放 new.py --record-dir 录制的真实补丁 ---
+
+def load_corpus(corpus_dir):
+    """按文件名顺序读取录制目录中的全部记录，返回 [(名称, 记录)]，名称为去掉 .json 的文件名。"""
+    records = []
+    for file_name in sorted(os.listdir(corpus_dir)):
+        if file_name.endswith(".json"):
+            records.append((file_name[:-len(".json")], _load_json(os.path.join(corpus_dir, file_name))))
+    return records
+
+
+def replay_corpus(records, repeat, progress=None):
+    """用 new.py 的引擎重新运行每条记录：计时，并检查输出是否仍与录制时的 modified_code 相同。
+
+    录制的结果来自 new.py，图形界面版的修剪与规范化规则不同，输出不可比较，因此只回放 cli 引擎。
+    """
+    results = []
+    for name, record in records:
+        timings, modified_code = time_call(run_cli, (record["commands"], record["original_code"]), repeat)
+        result = {"workload": name, "engine": "cli", "input_size": len(record["original_code"]), "repeat": repeat,
+                  "min_seconds": min(timings), "median_seconds": statistics.median(timings),
+                  "output_matches": modified_code == record["modified_code"]}
+        results.append(result)
+        if progress:
+            progress(result)
+    return results
+
+
+def environment_info():
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "platform": platform.platform(), "machine": platform.machine()}
+
+
+def compare_results(baseline, current, threshold, min_delta):
+    """按 (workload, engine) 对比两次结果的中位耗时，返回变慢超过 threshold 倍（且绝对差超过 min_delta 秒）的条目。"""
+    baseline_by_key = {(r["workload"], r["engine"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        base = baseline_by_key.get((result["workload"], result["engine"]))
+        if base is None:
+            continue
+        ratio = result["median_seconds"] / base["median_seconds"] if base["median_seconds"] else float("inf")
+        if ratio > threshold and result["median_seconds"] - base["median_seconds"] > min_delta:
+            regressions.append({"workload": result["workload"], "engine": result["engine"], "ratio": ratio,
+                                "baseline_seconds": base["median_seconds"], "current_seconds": result["median_seconds"]})
+    return regressions
+
+
+def _print_regressions(regressions, threshold):
+    if not regressions:
+        print(f"没有超过 {threshold:.2f} 倍的变慢。", file=sys.stderr)
+        return
+    print(f"以下 {len(regressions)} 项比基线慢 {threshold:.2f} 倍以上：", file=sys.stderr)
+    for r in regressions:
+        print(f"  {r['engine']:4} {r['workload']:28} {r['baseline_seconds'] * 1000:10.2f} ms -> "
+              f"{r['current_seconds'] * 1000:10.2f} ms  (x{r['ratio']:.2f})", file=sys.stderr)
+
+
+def _load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_report(report, output):
+    report_json = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(report_json + "\n")
+    else:
+        print(report_json)
+
+
+def _print_progress(result):
+    mismatch_note = "  输出与录制时不同!" if result.get("output_matches") is False else ""
+    print(f"{result['engine']:4} {result['workload']:28} {result['median_seconds'] * 1000:10.2f} ms{mismatch_note}",
+          file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="替换引擎基准测试：在生成的工作负载上计时 new.py 与 300.替换CLINE.py 的引擎")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="运行基准测试并输出 JSON 结果")
+    run_parser.add_argument("--output", help="结果写入此文件（默认标准输出）")
+    run_parser.add_argument("--repeat", type=int, default=3, help="每个工作负载运行的次数，报告最小值与中位数（默认 3）")
+    run_parser.add_argument("--filter", help="只运行名称匹配此正则的工作负载，名称形如 whitespace/10000l/100p")
+    run_parser.add_argument("--engines", default="cli,gui", help="逗号分隔的引擎名称：cli、gui（默认两者）")
+    run_parser.add_argument("--baseline", help="运行后与此基线结果比较，有变慢时退出码为 1")
+
+    replay_parser = subparsers.add_parser("replay", help="回放 new.py --record-dir 录制的语料，检查输出并计时")
+    replay_parser.add_argument("corpus_dir", help="录制目录")
+    replay_parser.add_argument("--output", help="结果写入此文件（默认标准输出）")
+    replay_parser.add_argument("--repeat", type=int, default=3, help="每条记录运行的次数，报告最小值与中位数（默认 3）")
+    replay_parser.add_argument("--baseline", help="与此前的回放结果比较，有变慢时退出码为 1")
+
+    compare_parser = subparsers.add_parser("compare", help="比较两份已保存的结果")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+
+    for sub in (run_parser, replay_parser, compare_parser):
+        sub.add_argument("--threshold", type=float, default=1.25, help="中位耗时超过基线的多少倍视为变慢（默认 1.25）")
+        sub.add_argument("--min-delta", type=float, default=0.002, help="绝对差低于此秒数时不视为变慢，忽略计时噪声（默认 0.002）")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        regressions = compare_results(_load_json(args.baseline), _load_json(args.current), args.threshold, args.min_delta)
+        _print_regressions(regressions, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    if args.repeat < 1:
+        parser.error("--repeat 至少为 1")
+    if args.command == "replay":
+        report = {"environment": environment_info(),
+                  "results": replay_corpus(load_corpus(args.corpus_dir), args.repeat, _print_progress)}
+        _write_report(report, args.output)
+        mismatches = [r["workload"] for r in report["results"] if not r["output_matches"]]
+        if mismatches:
+            print(f"{len(mismatches)} 条记录的输出与录制时不同：{', '.join(mismatches)}", file=sys.stderr)
+        regressions = []
+        if args.baseline:
+            regressions = compare_results(_load_json(args.baseline), report, args.threshold, args.min_delta)
+            _print_regressions(regressions, args.threshold)
+        sys.exit(1 if mismatches or regressions else 0)
+
+    engines = available_engines()
+    selected = args.engines.split(",")
+    unknown = [name for name in selected if name not in ("cli", "gui")]
+    if unknown:
+        parser.error(f"未知的引擎: {', '.join(unknown)}")
+    engines = {name: engine for name, engine in engines.items() if name in selected}
+
+    report = {"environment": environment_info(),
+              "results": run_benchmarks(engines, DEFAULT_MATRIX, args.repeat, args.filter, _print_progress)}
+    _write_report(report, args.output)
+
+    if args.baseline:
+        regressions = compare_results(_load_json(args.baseline), report, args.threshold, args.min_delta)
+        _print_regressions(regressions, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+
+import new
+import reference
+import reference_gui
+from bench import load_gui_module, make_headless_app
+
+# --- 被比较的引擎：每个函数 (commands, original_code) -> 结果，结果相同即行为一致 ---
+
+def _outcome(function):
+    """调用 function()，返回可比较的结果：正常时为 ("ok", modified_code, log)，抛出异常时为 ("error", 异常类型名)。"""
+    try:
+        modified_code, log = function()
+    except Exception as exc:
+        return ("error", type(exc).__name__)
+    return ("ok", modified_code, list(log))
+
+
+def run_reference(commands_str_raw, original_code):
+    # 参考实现把日志放在模块级列表中并返回它本身，下一次调用会清空，必须立即复制
+    return _outcome(lambda: tuple(reference.process_code_modifications_cli(commands_str_raw, original_code).values()))
+
+
+# new.py 与图形界面版在解析错误的提示中附加了出错位置的行列号（参考实现没有），比较前去掉
+_LINE_COLUMN_RE = re.compile(r' \(第 \d+ 行第 \d+ 列\)')
+
+
+def _strip_line_column(log):
+    return [_LINE_COLUMN_RE.sub('', line) for line in log]
+
+
+def run_memory(commands_str_raw, original_code):
+    """new.py 的 str 文档路径。"""
+    def run():
+        result = new.process_code_modifications_cli(commands_str_raw, original_code)
+        return result["modified_code"], _strip_line_column(result["log"])
+    return _outcome(run)
+
+
+def _write_temp_file(directory, text):
+    path = os.path.join(directory, "original.txt")
+    with open(path, 'wb') as f:
+        f.write(text.encode('utf-8'))
+    return path
+
+
+def run_file(commands_str_raw, original_code):
+    """new.py 的 mmap 字节文档路径（第1轮在 UTF-8 字节上匹配，需要时才解码）。"""
+    def run():
+        with tempfile.TemporaryDirectory() as directory:
+            result = new.process_code_modifications_file_cli(commands_str_raw, _write_temp_file(directory, original_code))
+        return result["modified_code"], _strip_line_column(result["log"])
+    return _outcome(run)
+
+
+def run_file_output(commands_str_raw, original_code):
+    """new.py 的 mmap 字节文档路径，结果按片段直接写入 output_file（末尾换行规则由 _needs_trailing_newline 判断）。"""
+    def run():
+        with tempfile.TemporaryDirectory() as directory:
+            output_file = os.path.join(directory, "output.txt")
+            result = new.process_code_modifications_file_cli(
+                commands_str_raw, _write_temp_file(directory, original_code), output_file)
+            with open(output_file, 'r', encoding='utf-8', newline='') as f:
+                return f.read(), _strip_line_column(result["log"])
+    return _outcome(run)
+
+
+def _run_app(app):
+    app.process_replacements()
+    return app.modified_code_text.get("1.0", "end-1c"), app.log_text.get("1.0", "end-1c").splitlines()
+
+
+def run_reference_gui(commands_str_raw, original_code):
+    return _outcome(lambda: _run_app(make_headless_app(reference_gui, commands_str_raw, original_code)))
+
+
+def make_gui_engine(gui_module):
+    """300.替换CLINE.py 的 process_replacements，与冻结的图形界面版参考实现 (reference_gui.py) 比较。"""
+    def run_gui(commands_str_raw, original_code):
+        def run():
+            modified_code, log = _run_app(make_headless_app(gui_module, commands_str_raw, original_code))
+            return modified_code, _strip_line_column(log)
+        return _outcome(run)
+    return run_gui
+
+
+# 引擎名称 -> (被测函数, 参考函数)
+ENGINES = {"memory": (run_memory, run_reference), "file": (run_file, run_reference),
+           "file_output": (run_file_output, run_reference)}
+_GUI_MODULE = load_gui_module()
+if _GUI_MODULE is not None:
+    ENGINES["gui"] = (make_gui_engine(_GUI_MODULE), run_reference_gui)
+
+
+# --- 调低优化引擎的阈值：小文档也走片段表重扫与 Aho–Corasick 自动机 ---
+
+# 默认阈值下，几 KB 的随机文档上每处第1轮命中都按稠密处理（整体 str.replace），自动机也从不构建，
+# 被比较的只是回退路径。调低后 _DENSE_EDIT_SPACING 取这些值之一：1 时从不视为稠密、片段也不会被合并，
+# 较大的值使部分替换对走稠密路径、过碎的文档被合并，覆盖几条路径之间的切换。
+_LOW_DENSE_EDIT_SPACINGS = (1, 2, 8, 64)
+
+
+@contextlib.contextmanager
+def lowered_thresholds(dense_edit_spacing):
+    """在 new.py 中临时调低阈值（图形界面版共用 new.py 的引擎）：每个文档都用自动机扫描，稠密判断的间距取 dense_edit_spacing。"""
+    settings = {"_DENSE_EDIT_SPACING": dense_edit_spacing, "_AHO_CORASICK_MIN_PATTERNS": 1,
+                "_AHO_CORASICK_MIN_TEXT_SIZE": 0}
+    saved = {name: getattr(new, name) for name in settings}
+    for name, value in settings.items():
+        setattr(new, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(new, name, value)
+
+
+# --- 随机生成文档与替换命令 ---
+
+_TOKENS = ["foo", "bar()", "baz(x, y)", "{", "}", "return  1;", "<div>", "</div>", "a = b", "x", "# 注释", "值 = 1", "é", "🙂"]
+_INDENTS = ["", " ", "  ", "    ", "\t", "\t  ", "        "]
+_LINE_ENDINGS = ["\n"] * 8 + ["\r\n"] * 3 + ["\r", "\x0c", "\u2028", " \n", "\t\n"]
+
+
+def _random_line(rng):
+    tokens = rng.sample(_TOKENS, rng.randint(0, 3))
+    return rng.choice(_INDENTS) + rng.choice([" ", "  ", "\t"]).join(tokens) + rng.choice(["", "", " ", "\t"])
+
+
+def random_document(rng, max_lines):
+    """随机的代码文本：缩进、空行与纯空白行，混合的换行符（含 CRLF 与 splitlines 认可的其它行分隔符），末尾可能没有换行。"""
+    crlf_only = rng.random() < 0.2
+    lines = [_random_line(rng) if rng.random() < 0.8 else rng.choice(["", "   ", "\t"])
+             for _ in range(rng.randint(0, max_lines))]
+    text = "".join(line + ("\r\n" if crlf_only else rng.choice(_LINE_ENDINGS)) for line in lines)
+    if rng.random() < 0.3:
+        text = text.rstrip("\r\n")
+    return text
+
+
+def _perturb_whitespace(rng, text):
+    """改变空白但不改变非空白内容，使精确匹配失败而宽松匹配仍可能命中。"""
+    output = []
+    for ch in text:
+        if ch in " \t" and rng.random() < 0.4:
+            output.append(rng.choice(["", " ", "  ", "\t"]))
+        elif ch == "\n" and rng.random() < 0.2:
+            output.append(rng.choice(["\n\n", "\r\n", " \n  "]))
+        else:
+            output.append(ch)
+    return "".join(output)
+
+
+def _random_search(rng, document):
+    lines = document.splitlines(True)
+    choice = rng.random()
+    if lines and choice < 0.6:
+        # 原文中连续的几行（可能改变空白），最常见的真实补丁形态
+        start = rng.randrange(len(lines))
+        block = "".join(lines[start:start + rng.randint(1, 4)])
+        return _perturb_whitespace(rng, block) if rng.random() < 0.6 else block
+    if document and choice < 0.85:
+        # 原文中的任意片段，可能跨行或只是行内的一部分
+        start = rng.randrange(len(document))
+        return document[start:start + rng.randint(0, 12)]
+    return rng.choice(["", " ", "\n", "zzz", "x", "a = b\nx"] + _TOKENS)
+
+
+def _random_replace(rng):
+    return rng.choice(["", "Q", "new()", "  new\n    line", "\nfoo\n", "X\r\nY", "\tif a:\n\t\tb\n", "多\n  行\n"]
+                      + _TOKENS)
+
+
+def random_commands(rng, document, max_pairs):
+    """随机的替换命令：大多是合法的 search/replace 对，偶尔有注释、多余文本或被截断（检查解析错误路径）。"""
+    parts = []
+    empty_search_used = False
+    for _ in range(rng.randint(1, max_pairs)):
+        search_val = _random_search(rng, document).replace("》", "")
+        if not search_val.strip():
+            # strip 后为空的 search 在每个字符前插入 replace，文档成倍增长；多个这样的对会让参考实现的
+            # 第2轮（逐行重复规范化）慢到无法运行，因此每个用例最多一个
+            if empty_search_used:
+                search_val = "x"
+            empty_search_used = True
+        replace_val = _random_replace(rng)
+        separator = rng.choice(["\n", " ", "\n\n", "\r\n"])
+        parts.append(f"search:{rng.choice(['', ' '])}《{search_val}》{separator}replace:《{replace_val}》\n")
+        if rng.random() < 0.05:
+            parts.append(rng.choice(["# 说明\n", "Path: a.py\n", "多余的文本\n"]))
+    commands_str_raw = "".join(parts)
+    if rng.random() < 0.05:
+        commands_str_raw = commands_str_raw[:rng.randrange(len(commands_str_raw) + 1)]
+    return commands_str_raw
+
+
+# --- 失败用例的自动最小化 ---
+
+def _shrink_string(text, still_fails):
+    """贪心删减：先按行、再按字符，尝试删去越来越小的片段，只保留仍然失败的删减，直到无法再缩小。"""
+    for split in (lambda s: s.splitlines(True), list):
+        units = split(text)
+        chunk_size = max(len(units) // 2, 1)
+        while chunk_size >= 1:
+            i = 0
+            while i < len(units):
+                candidate = units[:i] + units[i + chunk_size:]
+                if still_fails("".join(candidate)):
+                    units = candidate
+                else:
+                    i += chunk_size
+            chunk_size //= 2
+        text = "".join(units)
+    return text
+
+
+def minimize(commands_str_raw, original_code, fails):
+    """缩小 (commands, original_code)，使 fails(commands, original_code) 仍为真；交替缩小两者直到都不再变化。"""
+    while True:
+        smaller_commands = _shrink_string(commands_str_raw, lambda c: fails(c, original_code))
+        smaller_code = _shrink_string(original_code, lambda o: fails(smaller_commands, o))
+        if (smaller_commands, smaller_code) == (commands_str_raw, original_code):
+            return commands_str_raw, original_code
+        commands_str_raw, original_code = smaller_commands, smaller_code
+
+
+def find_mismatch(commands_str_raw, original_code, engines, dense_edit_spacing=None):
+    """返回第一个与其参考实现结果不同的引擎名称及两者的结果；全部一致时返回 None。
+
+    dense_edit_spacing 不为 None 时在 lowered_thresholds 下运行被测引擎（参考实现没有这些阈值）。
+    """
+    expected_by_reference = {}
+    for engine_name, (engine, run_expected) in engines.items():
+        if run_expected not in expected_by_reference:
+            expected_by_reference[run_expected] = run_expected(commands_str_raw, original_code)
+        expected = expected_by_reference[run_expected]
+        with lowered_thresholds(dense_edit_spacing) if dense_edit_spacing is not None else contextlib.nullcontext():
+            actual = engine(commands_str_raw, original_code)
+        if actual != expected:
+            return engine_name, expected, actual
+    return None
+
+
+def _save_failure(failures_dir, commands_str_raw, original_code, expected):
+    """保存为与 new.py --record-dir 相同格式的记录（modified_code 取参考实现的结果），修复后可用 bench.py replay 回归。"""
+    os.makedirs(failures_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="fuzz-", suffix=".json", dir=failures_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({"commands": commands_str_raw, "original_code": original_code,
+                   "modified_code": expected[1] if expected[0] == "ok" else None}, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="差分模糊测试：随机文档与替换命令，比较 new.py 的各条引擎路径与图形界面版引擎"
+                                     "与各自冻结的参考实现 (reference.py、reference_gui.py)")
+    parser.add_argument("--iterations", type=int, default=2000, help="随机用例的数量（默认 2000）")
+    parser.add_argument("--seed", type=int, help="随机种子（默认随机，发现失败时会打印出来以便复现）")
+    parser.add_argument("--max-lines", type=int, default=25, help="文档的最大行数（默认 25；小文档更容易覆盖边界情况）")
+    parser.add_argument("--max-pairs", type=int, default=5, help="每个用例的最大替换对数（默认 5）")
+    parser.add_argument("--engines", default=",".join(ENGINES), help=f"逗号分隔的引擎路径（默认全部：{', '.join(ENGINES)}）")
+    parser.add_argument("--max-failures", type=int, default=1, help="发现多少个失败用例后停止（默认 1）")
+    parser.add_argument("--failures-dir", help="把最小化后的失败用例保存到此目录")
+    parser.add_argument("--low-threshold-ratio", type=float, default=0.5,
+                        help="在调低阈值（见 lowered_thresholds）下运行的用例比例（默认 0.5；0 表示只用默认阈值）")
+    args = parser.parse_args()
+    unknown = [name for name in args.engines.split(",") if name not in ENGINES]
+    if unknown:
+        parser.error(f"未知的引擎路径: {', '.join(unknown)}")
+    if not 0 <= args.low_threshold_ratio <= 1:
+        parser.error("--low-threshold-ratio 必须在 0 到 1 之间")
+    engines = {name: ENGINES[name] for name in args.engines.split(",")}
+    if _GUI_MODULE is None:
+        print("提示: 无法导入 tkinter，跳过图形界面版引擎 (gui)。", file=sys.stderr)
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 32)
+    rng = random.Random(seed)
+    failures = 0
+    for iteration in range(args.iterations):
+        original_code = random_document(rng, args.max_lines)
+        commands_str_raw = random_commands(rng, original_code, args.max_pairs)
+        dense_edit_spacing = (rng.choice(_LOW_DENSE_EDIT_SPACINGS) if rng.random() < args.low_threshold_ratio
+                              else None)
+        if find_mismatch(commands_str_raw, original_code, engines, dense_edit_spacing) is None:
+            continue
+        failures += 1
+        commands_str_raw, original_code = minimize(
+            commands_str_raw, original_code,
+            lambda c, o: find_mismatch(c, o, engines, dense_edit_spacing) is not None)
+        engine_name, expected, actual = find_mismatch(commands_str_raw, original_code, engines, dense_edit_spacing)
+        thresholds = ("默认阈值" if dense_edit_spacing is None
+                      else f"调低的阈值，_DENSE_EDIT_SPACING = {dense_edit_spacing}")
+        print(f"第 {iteration + 1} 个用例（种子 {seed}，{thresholds}）：引擎路径 {engine_name} 与参考实现不同。最小化后的用例：",
+              file=sys.stderr)
+        print(json.dumps({"commands": commands_str_raw, "original_code": original_code,
+                          "expected": expected, "actual": actual}, ensure_ascii=False, indent=2), file=sys.stderr)
+        if args.failures_dir:
+            print(f"已保存到 {_save_failure(args.failures_dir, commands_str_raw, original_code, expected)}", file=sys.stderr)
+        if failures >= args.max_failures:
+            break
+    print(f"种子 {seed}：运行 {iteration + 1 if args.iterations else 0} 个用例，{failures} 个与参考实现不同。", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,341 @@
 import argparse
+import bisect
+import cProfile
+import glob
+import hashlib
+import io
+import mmap
+import multiprocessing
+import os
 import re
+import signal
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
 import json # 用于输出JSON
 
 # --- 从你原始脚本中保留的核心函数 ---
 
-cli_log_messages = []
+# --- 结构化事件日志 ---
 
-def _cli_log(message):
-    """将日志消息收集到列表中，以便最后作为JSON一部分输出。"""
-    global cli_log_messages
-    # print(f"LOG: {message}") # 在命令行运行时打印一些即时反馈 (可选)
-    cli_log_messages.append(message)
+_LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40, "off": 100}
 
-def _clear_cli_log():
-    """清空日志列表。"""
-    global cli_log_messages
-    cli_log_messages = []
+# 事件类型 -> (级别, 生成日志文本的函数)。记录事件时只保存事件类型与字段，文本在输出日志时才生成；
+# 低于当前级别的事件直接丢弃。
+_EVENT_TYPES = {
+    "commands_empty": ("warning", lambda e: "提示: 命令输入为空，未执行替换。"),
+    "delimiter_not_found": ("error", lambda e:
+        f"错误: 从内容开始位置 {e['offset']} (相对于命令字符串的偏移量) (第 {e['line']} 行第 {e['column']} 列) 开始，未能找到结束界定符 '{e['delimiter']}'。"),
+    "no_more_directives": ("warning", lambda e:
+        f"解析提示：在命令文本中，从位置 {e['offset']} (第 {e['line']} 行第 {e['column']} 列) 开始，未找到更多有效的 'search:《' 指令。"),
+    "replace_directive_missing": ("error", lambda e:
+        f"错误：在 'search:《{e['search_head']}...》' 内容之后，从位置 {e['offset']} (第 {e['line']} 行第 {e['column']} 列) 开始，未找到 'replace:《' 指令。"),
+    "parse_failed": ("error", lambda e:
+        "命令解析失败或未找到完整命令对。请确保使用 'search:《内容》 replace:《内容》' 格式，并用书名号《》包裹实际内容。"),
+    "no_pairs": ("warning", lambda e: "未在命令区找到有效的 search/replace 对。"),
+    "commands_parsed": ("info", lambda e:
+        f"成功解析 {e['count']} 个 search/replace 替换对。{'开始流式处理...' if e['streaming'] else '开始处理...'}"),
+    "pair_start": ("info", lambda e: f"\n--- 第 {e['pair']} 对 ---"),
+    "pair_search": ("info", lambda e: f"Search (trimmed, for exact match): '{_format_for_log(e['search'])}'"),
+    "pair_replace": ("info", lambda e: f"Replace (trimmed): '{_format_for_log(e['replace'])}'"),
+    "round_1_replaced": ("info", lambda e: f"执行替换 (第1轮 精确匹配): 找到并替换了 {e['count']} 处。"),
+    "round_1_no_match": ("info", lambda e:
+        f"第1轮 精确匹配: 未找到 search 字符串 '{_format_for_log(e['search'])}'。"
+        + ("流式模式不执行第2轮宽松匹配，此对未执行任何替换。" if e['streaming'] else "尝试第2轮宽松匹配...")),
+    "round_2_start": ("debug", lambda e: "  Attempting 2nd round: Iterative Whitespace-agnostic multi-line search..."),
+    "round_2_empty_search": ("info", lambda e: "  2nd round: Search block is effectively empty after normalization. Skipping."),
+    "round_2_match": ("debug", lambda e:
+        f"  2nd round: Found whitespace-agnostic match. Original lines {e['first_line']} through {e['last_line']}."),
+    "round_2_completed": ("info", lambda e: f"  2nd round (Iterative): Completed with {e['count']} replacement(s)."),
+    "round_2_no_match": ("info", lambda e: f"  第2轮 宽松匹配: 也未找到匹配项。此对未执行任何替换。"),
+    "all_done": ("info", lambda e: f"\n--- 所有替换完成 ---"),
+    "summary": ("info", lambda e:
+        f"总计: 第1轮替换 {e['round_1']} 处 (流式模式)。" if e['round_2'] is None
+        else f"总计: 第1轮替换 {e['round_1']} 处, 第2轮替换 {e['round_2']} 处。"),
+}
+_EVENT_LEVELS = {event_type: _LOG_LEVELS[level] for event_type, (level, _) in _EVENT_TYPES.items()}
+
+
+class _Metrics:
+    """一次调用的性能指标：各阶段耗时（秒）、第2轮扫描的行数、规范化的行数、复制的数据量与文档峰值大小。
+
+    复制量与文档大小的单位：str 文档为字符数，bytes/mmap 文档为字节数。
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.parse_seconds = 0.0
+        self.pairs = []
+        self.lines_scanned = 0
+        self.normalizations = 0
+        self.bytes_copied = 0
+        self.peak_document_size = 0
+
+    def add_pair(self, round_1_seconds, round_2_seconds, round_1_replacements, round_2_replacements):
+        self.pairs.append({"pair": len(self.pairs) + 1,
+                           "round_1_seconds": round_1_seconds, "round_2_seconds": round_2_seconds,
+                           "round_1_replacements": round_1_replacements, "round_2_replacements": round_2_replacements})
+
+    def as_dict(self):
+        return {
+            "total_seconds": time.perf_counter() - self.started_at,
+            "parse_seconds": self.parse_seconds,
+            "round_1_seconds": sum(pair["round_1_seconds"] for pair in self.pairs),
+            "round_2_seconds": sum(pair["round_2_seconds"] for pair in self.pairs),
+            "lines_scanned": self.lines_scanned,
+            "normalizations": self.normalizations,
+            "bytes_copied": self.bytes_copied,
+            "peak_document_size": self.peak_document_size,
+            "pairs": self.pairs,
+        }
+
+
+class _Tracer:
+    """按 Chrome trace-event 格式记录各阶段的起止时间，写出的 JSON 可直接在 chrome://tracing 或 Perfetto 中打开。
+
+    每个阶段是一个完整事件（ph 为 "X"），时间戳为相对于调用开始的微秒数；嵌套关系由时间包含关系体现。
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.pid = os.getpid()
+        self.tid = threading.get_native_id()
+        self.events = []
+
+    def add(self, name, started_at, finished_at, args):
+        self.events.append({"name": name, "cat": "engine", "ph": "X", "pid": self.pid, "tid": self.tid,
+                            "ts": (started_at - self.started_at) * 1e6, "dur": (finished_at - started_at) * 1e6,
+                            "args": args})
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+
+class _CallContext:
+    """一次处理调用的全部可变状态（事件日志等），由入口函数创建并显式传给各个步骤。
+
+    模块中没有可变的全局状态：每次调用 process_code_modifications_cli、process_code_modifications_file_cli
+    或 stream_code_modifications_cli 都使用自己的上下文，因此可以在多个线程（线程池、服务器）中并发调用，
+    各自的结果与日志互不影响。同一个上下文对象不应在多个线程间共享。
+
+    log_level 为 _LOG_LEVELS 中的名称，低于它的事件不会被记录；log_format 为 "text" 时结果中给出
+    日志文本列表 "log"，为 "events" 时给出结构化事件列表 "events"。collect_metrics 为真时收集
+    _Metrics 并在结果中给出 "metrics"，否则 metrics 为 None，各步骤跳过统计。trace_file 不为空时
+    记录各阶段的 trace 事件，组装结果时写入该文件（Chrome trace-event JSON）并在结果中给出 "trace_file"；
+    子任务的上下文可以共用父上下文的 tracer（不设 trace_file），由父上下文统一写出。
+    memory_snapshot 为 --profile mem 时 _run_profiled 创建的 _PeakMemorySnapshot，各步骤在阶段边界调用
+    memory_checkpoint()；它同样属于这一次调用（及其子任务的上下文），不放在模块全局中。
+    """
+
+    def __init__(self, log_level="debug", log_format="text", collect_metrics=False, trace_file=None,
+                 memory_snapshot=None):
+        if log_level not in _LOG_LEVELS:
+            raise ValueError(f"未知的日志级别: {log_level}")
+        if log_format not in ("text", "events"):
+            raise ValueError(f"未知的日志格式: {log_format}")
+        self.log_level = _LOG_LEVELS[log_level]
+        self.log_format = log_format
+        self.events = []
+        self.pair_index = None  # 正在处理的替换对（从 1 开始），自动附加到事件中
+        self.parse_problem_reported = False
+        self.metrics = _Metrics() if collect_metrics else None
+        self.trace_file = trace_file
+        self.tracer = _Tracer() if trace_file else None
+        self.memory_snapshot = memory_snapshot
+
+    def emit(self, event_type, **fields):
+        """记录一个事件（不生成任何文本）。"""
+        if _EVENT_LEVELS[event_type] < self.log_level:
+            return
+        if self.pair_index is not None:
+            fields.setdefault("pair", self.pair_index)
+        self.events.append((event_type, fields))
+
+    def trace(self, name, started_at, finished_at=None, **args):
+        """记录一个从 started_at 到 finished_at（默认为现在）的阶段；未开启 trace 时什么也不做。"""
+        if self.tracer is None:
+            return
+        if self.pair_index is not None:
+            args.setdefault("pair", self.pair_index)
+        self.tracer.add(name, started_at, time.perf_counter() if finished_at is None else finished_at, args)
+
+    def memory_checkpoint(self):
+        """在阶段边界更新内存剖析的峰值快照；未开启内存剖析时什么也不做。"""
+        if self.memory_snapshot is not None:
+            self.memory_snapshot.checkpoint()
+
+    def log_messages(self):
+        return [_EVENT_TYPES[event_type][1](fields) for event_type, fields in self.events]
+
+    def structured_events(self):
+        return [{"event": event_type, "level": _EVENT_TYPES[event_type][0],
+                 **{key: _format_for_log(value) if isinstance(value, str) else value for key, value in fields.items()}}
+                for event_type, fields in self.events]
+
+    def result(self, **fields):
+        """组装返回结果：在 fields 之后附加日志文本或结构化事件。"""
+        if self.log_format == "events":
+            fields["events"] = self.structured_events()
+        else:
+            fields["log"] = self.log_messages()
+        if self.metrics is not None:
+            fields["metrics"] = self.metrics.as_dict()
+        if self.trace_file:
+            self.tracer.write(self.trace_file)
+            fields["trace_file"] = self.trace_file
+        return fields
+
+_WHITESPACE_RUN_RE = re.compile(r'\s+')
 
 def _normalize_text_block(text_block):
     lines = text_block.splitlines()
     stripped_lines = [line.strip() for line in lines]
     normalized_lines = []
     for line in stripped_lines:
-        normalized_line = re.sub(r'\s+', ' ', line)
+        normalized_line = _WHITESPACE_RUN_RE.sub(' ', line)
         if normalized_line: 
             normalized_lines.append(normalized_line)
     return normalized_lines
 
+# splitlines() 除 '\n'（及 '\r\n'）外还在这些字符处分行；文本中没有它们时，splitlines 的各行与按 '\n' 分行一一对应
+_OTHER_LINE_BREAK_RE = re.compile('\r(?!\n)|[\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+class _NormalizedLineIndex:
+    """文档某一版本的规范化行索引：每行只规范化一次，供第2轮所有替换对和扫描位置复用。
+
+    行内的空白串替换为 whitespace_replacement（命令行版为一个空格，图形界面版为空串）。
+    由 for_document 为 PieceTable 建立的索引在文档被编辑后可调用 update() 增量更新，只重新读取、规范化被改写的行；
+    直接由文本建立的索引在文档修改后需重新构建。
+    """
+
+    def __init__(self, text, whitespace_replacement=' '):
+        self.whitespace_replacement = whitespace_replacement
+        self.version = None  # for_document 建立时为文档的 version
+        self.lines = text.splitlines(True)
+        self.line_offsets = []
+        self.content_line_indices = []
+        self.content_normalized_lines = []
+        offset = 0
+        normalize_whitespace = _WHITESPACE_RUN_RE.sub
+        for line_idx, line in enumerate(self.lines):
+            self.line_offsets.append(offset)
+            offset += len(line)
+            # 与 _normalize_line 相同，内联以免每行一次方法调用
+            normalized_line = normalize_whitespace(whitespace_replacement, line.strip())
+            if normalized_line:
+                self.content_line_indices.append(line_idx)
+                self.content_normalized_lines.append(normalized_line)
+        self.line_offsets.append(offset)
+        # 按 '\n' 分行时，以 '\n' 结尾的文本（及空文本）最后还有一个空行，splitlines 不计入
+        self._trailing_empty_line = not text or text.endswith('\n')
+        # 没有其他分行符时 splitlines 的行数恰好由 '\n' 的个数决定；以其他分行符结尾时行数也可能凑巧相等，末行另查
+        self._newline_aligned = (len(self.lines) == text.count('\n') + (not self._trailing_empty_line)
+                                 and not (self.lines and _OTHER_LINE_BREAK_RE.search(self.lines[-1])))
+
+    def _normalize_line(self, line):
+        # splitlines(True) 得到的单行只含一个行尾符，且行尾符均为空白字符，
+        # 因此直接 strip 整行与 _normalize_text_block(line)[0] 结果一致。
+        return _WHITESPACE_RUN_RE.sub(self.whitespace_replacement, line.strip())
+
+    @classmethod
+    def for_document(cls, document, whitespace_replacement=' '):
+        """为 PieceTable 文档的当前版本建立索引，并让文档开始记录改动的行，供 update() 使用。"""
+        line_index = cls(document.text(), whitespace_replacement)
+        line_index.version = document.version
+        document.track_line_changes()
+        return line_index
+
+    def update(self, document):
+        """按 document.line_changes 把索引更新到文档的当前版本，返回 (重新规范化的行数, 重新读取的字符数)。
+
+        文档被整体重写（reset）过、索引不是由 for_document 为它建立的，或文本含有 '\\n' 以外的分行符时
+        无法增量更新，返回 None，调用方应重新建立索引。
+        """
+        line_changes = document.line_changes
+        if (self.version is None or line_changes is None or not self._newline_aligned
+                or self.version + len(line_changes) != document.version):
+            return None
+        # 按 '\n' 分行的各行；None 表示被改写、稍后从文档读取（被改写的行不在内容行列表中）
+        lines = self.lines + [""] if self._trailing_empty_line else list(self.lines)
+        content_line_indices = self.content_line_indices
+        content_normalized_lines = self.content_normalized_lines
+        for changed_lines in line_changes:
+            new_lines, new_content_line_indices, new_content_normalized_lines = [], [], []
+            line_cursor = content_cursor = line_shift = 0
+            for first_line, end_line, line_delta in changed_lines:
+                content_stop = bisect.bisect_left(content_line_indices, first_line, content_cursor)
+                new_lines.extend(lines[line_cursor:first_line])
+                new_content_line_indices.extend(
+                    line_idx + line_shift for line_idx in content_line_indices[content_cursor:content_stop])
+                new_content_normalized_lines.extend(content_normalized_lines[content_cursor:content_stop])
+                new_lines.extend([None] * (end_line - first_line + line_delta))
+                line_cursor = end_line
+                content_cursor = bisect.bisect_left(content_line_indices, end_line, content_stop)
+                line_shift += line_delta
+            new_lines.extend(lines[line_cursor:])
+            new_content_line_indices.extend(line_idx + line_shift for line_idx in content_line_indices[content_cursor:])
+            new_content_normalized_lines.extend(content_normalized_lines[content_cursor:])
+            lines = new_lines
+            content_line_indices, content_normalized_lines = new_content_line_indices, new_content_normalized_lines
+
+        # 逐段读取被改写的行（第 k 行从 document.line_to_offset(k) 开始），与未改动的内容行按行号合并
+        merged_line_indices, merged_normalized_lines = [], []
+        content_cursor = run_end = 0
+        refreshed_lines = refreshed_size = 0
+        while True:
+            try:
+                run_start = lines.index(None, run_end)
+            except ValueError:
+                break
+            run_end = run_start + 1
+            while run_end < len(lines) and lines[run_end] is None:
+                run_end += 1
+            region_end = document.line_to_offset(run_end) if run_end < len(lines) else len(document)
+            region = document.slice(document.line_to_offset(run_start), region_end)
+            if _OTHER_LINE_BREAK_RE.search(region):
+                return None
+            region_lines = region.splitlines(True)
+            if run_end == len(lines) and (not region or region.endswith('\n')):
+                region_lines.append("")
+            if len(region_lines) != run_end - run_start:
+                return None
+            lines[run_start:run_end] = region_lines
+            content_stop = bisect.bisect_left(content_line_indices, run_start, content_cursor)
+            merged_line_indices.extend(content_line_indices[content_cursor:content_stop])
+            merged_normalized_lines.extend(content_normalized_lines[content_cursor:content_stop])
+            content_cursor = content_stop
+            for line_idx, line in enumerate(region_lines, run_start):
+                normalized_line = self._normalize_line(line)
+                if normalized_line:
+                    merged_line_indices.append(line_idx)
+                    merged_normalized_lines.append(normalized_line)
+            refreshed_lines += len(region_lines)
+            refreshed_size += len(region)
+        merged_line_indices.extend(content_line_indices[content_cursor:])
+        merged_normalized_lines.extend(content_normalized_lines[content_cursor:])
+
+        self._trailing_empty_line = lines[-1] == ""
+        if self._trailing_empty_line:
+            lines.pop()
+        self.lines = lines
+        self.line_offsets = [0]
+        self.line_offsets.extend(accumulate(map(len, lines)))
+        self.content_line_indices = merged_line_indices
+        self.content_normalized_lines = merged_normalized_lines
+        self.version = document.version
+        document.track_line_changes()
+        return refreshed_lines, refreshed_size
+
 def _get_line_indentation(line_text):
     match = re.match(r'^(\s*)', line_text)
     return match.group(1) if match else ""
@@ -68,198 +377,1913 @@ def _reindent_block(text_block_to_reindent, target_indentation):
         processed_lines.append(target_indentation + line_content_for_reindent)
     return "\n".join(processed_lines)
 
-def _replace_whitespace_agnostic(code_to_search_in, search_block_query, replace_block_content):
-    _cli_log("  Attempting 2nd round: Iterative Whitespace-agnostic multi-line search...")
+def _kmp_failure_table(pattern):
+    failure = [0] * len(pattern)
+    matched_len = 0
+    for i in range(1, len(pattern)):
+        while matched_len and pattern[i] != pattern[matched_len]:
+            matched_len = failure[matched_len - 1]
+        if pattern[i] == pattern[matched_len]:
+            matched_len += 1
+        failure[i] = matched_len
+    return failure
+
+def _kmp_find_all(sequence, pattern):
+    """KMP 序列匹配：返回 pattern 在 sequence 中所有（可重叠）出现的起始下标，O(len(sequence) + len(pattern))。"""
+    if not pattern:
+        return []
+    failure = _kmp_failure_table(pattern)
+    pattern_len = len(pattern)
+    match_starts = []
+    matched_len = 0
+    for i, item in enumerate(sequence):
+        while matched_len and item != pattern[matched_len]:
+            matched_len = failure[matched_len - 1]
+        if item == pattern[matched_len]:
+            matched_len += 1
+            if matched_len == pattern_len:
+                match_starts.append(i - pattern_len + 1)
+                matched_len = failure[matched_len - 1]
+    return match_starts
+
+def _whitespace_agnostic_edits(context, line_index, search_block_query, replace_block_content):
+    """第2轮宽松匹配：返回针对 line_index 所在文档的 (start, end, replacement) 编辑列表，按位置升序。"""
+    context.emit("round_2_start")
+    scan_started_at = time.perf_counter()
     normalized_search_lines = _normalize_text_block(search_block_query)
 
     if not normalized_search_lines:
-        _cli_log("  2nd round: Search block is effectively empty after normalization. Skipping.")
-        return code_to_search_in, 0
+        context.emit("round_2_empty_search")
+        return []
 
-    original_code_lines_with_endings = code_to_search_in.splitlines(True) 
-    output_buffer = []
+    original_code_lines_with_endings = line_index.lines
+    line_offsets = line_index.line_offsets
+    content_line_indices = line_index.content_line_indices
+    num_search_lines = len(normalized_search_lines)
+    # 在内容行序列（跳过空行）上用 KMP 一次性求出所有完整匹配的起点，总代价 O(N + M)。
+    match_start_positions = set(_kmp_find_all(line_index.content_normalized_lines, normalized_search_lines))
+    edits = []
     current_original_line_idx = 0
-    replacements_made_this_pass = 0
-
-    while current_original_line_idx < len(original_code_lines_with_endings):
-        match_found_here = False
-        normalized_search_ptr = 0
-        first_content_line_in_matched_block_original_idx = -1
-        end_of_matched_original_block_idx = -1 
-        block_scan_idx = current_original_line_idx 
-        
-        while block_scan_idx < len(original_code_lines_with_endings) and \
-              normalized_search_ptr < len(normalized_search_lines):
-            current_original_line_text = original_code_lines_with_endings[block_scan_idx]
-            normalized_original_line_list = _normalize_text_block(current_original_line_text)
-
-            if normalized_original_line_list: 
-                if normalized_original_line_list[0] == normalized_search_lines[normalized_search_ptr]:
-                    if first_content_line_in_matched_block_original_idx == -1:
-                        first_content_line_in_matched_block_original_idx = block_scan_idx
-                    normalized_search_ptr += 1
-                    if normalized_search_ptr == len(normalized_search_lines): 
-                        match_found_here = True
-                        end_of_matched_original_block_idx = block_scan_idx 
-                        break 
-                else: 
-                    if normalized_search_ptr > 0:
-                        break 
-            block_scan_idx += 1
-        
-        if match_found_here:
-            replacements_made_this_pass += 1
-            start_of_block_to_replace_idx = current_original_line_idx 
-            _cli_log(f"  2nd round: Found whitespace-agnostic match. Original lines "
-                      f"{start_of_block_to_replace_idx + 1} through {end_of_matched_original_block_idx + 1}.")
-            indent_ref_idx = first_content_line_in_matched_block_original_idx \
-                             if first_content_line_in_matched_block_original_idx != -1 \
-                             else start_of_block_to_replace_idx 
-            target_indent = _get_line_indentation(original_code_lines_with_endings[indent_ref_idx])
-            reindented_replace_block_str = _reindent_block(replace_block_content, target_indent)
-
-            if reindented_replace_block_str and '\n' in replace_block_content and not reindented_replace_block_str.endswith(('\n', '\r\n')):
-                last_line_of_replaced_block = original_code_lines_with_endings[end_of_matched_original_block_idx]
-                if last_line_of_replaced_block.endswith('\r\n'):
-                    reindented_replace_block_str += '\r\n'
-                elif last_line_of_replaced_block.endswith('\n'):
-                    reindented_replace_block_str += '\n'
-            elif not reindented_replace_block_str and replace_block_content: 
-                pass 
-            elif not replace_block_content: 
-                 reindented_replace_block_str = ""
-
-            output_buffer.append(reindented_replace_block_str)
-            current_original_line_idx = end_of_matched_original_block_idx + 1 
+
+    # 逐行扫描的语义：从当前行起跳过与 search 首行不同的内容行，直到第一个等于 search 首行的
+    # 内容行（锚点）。锚点处完整匹配则替换 [当前行, 匹配末行]；否则当前行到锚点保持不变。
+    for content_pos, normalized_original_line in enumerate(line_index.content_normalized_lines):
+        if normalized_original_line != normalized_search_lines[0]:
+            continue
+        anchor_line_idx = content_line_indices[content_pos]
+        if anchor_line_idx < current_original_line_idx:
+            continue
+        if content_pos not in match_start_positions:
+            current_original_line_idx = anchor_line_idx + 1
+            continue
+
+        end_of_matched_original_block_idx = content_line_indices[content_pos + num_search_lines - 1]
+        start_of_block_to_replace_idx = current_original_line_idx 
+        context.emit("round_2_match", first_line=start_of_block_to_replace_idx + 1,
+                     last_line=end_of_matched_original_block_idx + 1)
+        reindent_started_at = time.perf_counter()
+        target_indent = _get_line_indentation(original_code_lines_with_endings[anchor_line_idx])
+        reindented_replace_block_str = _reindent_block(replace_block_content, target_indent)
+        context.trace("reindent", reindent_started_at, line=anchor_line_idx + 1)
+
+        if reindented_replace_block_str and '\n' in replace_block_content and not reindented_replace_block_str.endswith(('\n', '\r\n')):
+            last_line_of_replaced_block = original_code_lines_with_endings[end_of_matched_original_block_idx]
+            if last_line_of_replaced_block.endswith('\r\n'):
+                reindented_replace_block_str += '\r\n'
+            elif last_line_of_replaced_block.endswith('\n'):
+                reindented_replace_block_str += '\n'
+        elif not reindented_replace_block_str and replace_block_content: 
+            pass 
+        elif not replace_block_content: 
+             reindented_replace_block_str = ""
+
+        edits.append((line_offsets[start_of_block_to_replace_idx],
+                      line_offsets[end_of_matched_original_block_idx + 1],
+                      reindented_replace_block_str))
+        current_original_line_idx = end_of_matched_original_block_idx + 1 
+
+    if edits:
+        context.emit("round_2_completed", count=len(edits))
+    context.trace("round_2_scan", scan_started_at, matches=len(edits))
+
+    return edits
+
+def _replace_whitespace_agnostic(context, code_to_search_in, search_block_query, replace_block_content, line_index=None):
+    """第2轮宽松匹配的字符串版本：返回 (替换后代码, 替换次数)。line_index 未提供时临时构建。"""
+    if line_index is None:
+        line_index = _NormalizedLineIndex(code_to_search_in)
+    edits = _whitespace_agnostic_edits(context, line_index, search_block_query, replace_block_content)
+    return _apply_edits_to_text(code_to_search_in, edits), len(edits)
+
+# --- 编辑计划 (Edit Plan) ---
+
+def _resolve_edit_order(edits):
+    """把 (start, end, replacement) 编辑按位置排序（同一位置保持原顺序），并检查互不重叠。"""
+    ordered_edits = sorted(edits, key=lambda edit: (edit[0], edit[1]))
+    previous_end = 0
+    for start, end, _ in ordered_edits:
+        if start < previous_end or end < start:
+            raise ValueError(f"编辑区间重叠或无效: [{start}, {end})")
+        previous_end = end
+    return ordered_edits
+
+def _apply_edits_to_text(text, edits):
+    """一次拼接完成所有编辑，代价 O(len(text) + 编辑数)。"""
+    if not edits:
+        return text
+    chunks = []
+    cursor = 0
+    for start, end, replacement in _resolve_edit_order(edits):
+        chunks.append(text[cursor:start])
+        chunks.append(replacement)
+        cursor = end
+    chunks.append(text[cursor:])
+    return "".join(chunks)
+
+# --- 文档模型：片段表 (Piece Table) ---
+
+class PieceTable:
+    """片段表文档模型：原始文本只读保存，文档由引用原始文本或插入文本的片段依次拼接而成。
+
+    插入、删除只改动片段列表而不复制整份文本；每个片段记录自身包含的换行符数量（被截断的
+    片段在首次按行查询时才补算），偏移量与行号（从 0 开始，按 '\\n' 分行）之间的换算对片段
+    前缀和二分查找，为 O(log n)。
+    每次修改后 version 加一，便于调用方判断缓存是否失效。调用 track_line_changes() 之后，每批编辑改动了
+    哪些行记录在 line_changes 中，按行建立的索引（_NormalizedLineIndex）据此只更新被改写的行。
+    original_text 也可以是 bytes 或只读 mmap（此时插入文本须为 bytes，text() 返回 bytes 或 mmap 本身）。
+    """
+
+    def __init__(self, original_text):
+        self.original_text = original_text
+        self._empty = original_text[:0]
+        self._newline = '\n' if isinstance(original_text, str) else b'\n'
+        # 片段: (inserted_text, start, end, line_breaks)；inserted_text 为 None 表示引用原始文本，
+        # line_breaks 为 None 表示尚未统计
+        self._pieces = [(None, 0, len(original_text), None)] if original_text else []
+        self._original_newline_offsets = None
+        self._text = original_text
+        self.version = 0
+        self.copied_size = 0  # text()、slice()、encoded_chunks() 累计复制的数据量
+        # 未记录时为 None；否则每次修改追加一项，为该批编辑改动的行 [(first_line, end_line, line_delta), ...]：
+        # 修改前的第 first_line 行到第 end_line 行之前被改写，行数增加 line_delta，各项按行号升序、互不重叠
+        self.line_changes = None
+        self._rebuild_prefix_sums()
+
+    def _rebuild_prefix_sums(self):
+        self._piece_starts = [0]
+        self._piece_starts.extend(accumulate(end - start for _, start, end, _ in self._pieces))
+        self._length = self._piece_starts.pop()
+        self._piece_line_starts = None
+
+    def _ensure_line_prefix_sums(self):
+        if self._piece_line_starts is not None:
+            return
+        self._pieces = [piece if piece[3] is not None
+                        else piece[:3] + (self._count_line_breaks(*piece[:3]),) for piece in self._pieces]
+        self._piece_line_starts = [0]
+        self._piece_line_starts.extend(accumulate(piece[3] for piece in self._pieces))
+        self._line_break_count = self._piece_line_starts.pop()
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def pieces(self):
+        return self._pieces
+
+    @property
+    def piece_starts(self):
+        return self._piece_starts
+
+    def text(self):
+        if self._text is None:
+            original_text = self.original_text
+            self.copied_size += self._length
+            self._text = self._empty.join((original_text if inserted_text is None else inserted_text)[start:end]
+                                 for inserted_text, start, end, _ in self._pieces)
+        return self._text
+
+    def slice(self, start, end):
+        original_text = self.original_text
+        self.copied_size += max(0, min(end, self._length) - start)
+        return self._empty.join((original_text if inserted_text is None else inserted_text)[piece_start:piece_end]
+                       for inserted_text, piece_start, piece_end, _ in self._pieces_between(start, end))
+
+    def encoded_chunks(self, append_newline=False):
+        """按片段依次产出输出内容的 UTF-8 字节，不拼接整份文本；bytes 文档原样产出，str 文档不转换换行符。"""
+        original_text = self.original_text
+        encode = isinstance(original_text, str)
+        self.copied_size += self._length
+        for inserted_text, start, end, _ in self._pieces:
+            chunk = (original_text if inserted_text is None else inserted_text)[start:end]
+            yield chunk.encode('utf-8') if encode else chunk
+        if append_newline:
+            yield b'\n'
+
+    def _get_original_newline_offsets(self):
+        if self._original_newline_offsets is None:
+            self._original_newline_offsets = [match.start() for match in re.finditer(self._newline, self.original_text)]
+        return self._original_newline_offsets
+
+    def _count_line_breaks(self, inserted_text, start, end):
+        if inserted_text is not None:
+            return inserted_text.count(self._newline, start, end)
+        newline_offsets = self._get_original_newline_offsets()
+        return bisect.bisect_left(newline_offsets, end) - bisect.bisect_left(newline_offsets, start)
+
+    def _pieces_between(self, start, end):
+        """覆盖当前文档 [start, end) 的片段，两端片段按需截断（截断不复制文本）。"""
+        if start >= end:
+            return []
+        first_idx = bisect.bisect_right(self._piece_starts, start) - 1
+        last_idx = bisect.bisect_left(self._piece_starts, end) - 1
+        pieces = self._pieces[first_idx:last_idx + 1]
+        for idx in {0, len(pieces) - 1}:
+            inserted_text, piece_start, piece_end, _ = pieces[idx]
+            doc_start = self._piece_starts[first_idx + idx]
+            lo = piece_start + max(start, doc_start) - doc_start
+            hi = piece_start + min(end, doc_start + piece_end - piece_start) - doc_start
+            if lo != piece_start or hi != piece_end:
+                pieces[idx] = (inserted_text, lo, hi, None)
+        return pieces
+
+    def track_line_changes(self):
+        """从当前版本起记录每批编辑改动的行（清空此前的记录）。"""
+        self.line_changes = []
+
+    def _changed_lines(self, ordered_edits):
+        changed_lines = []
+        for start, end, replacement in ordered_edits:
+            first_line = self.offset_to_line(start)
+            last_line = self.offset_to_line(end)
+            line_delta = replacement.count(self._newline) - (last_line - first_line)
+            if changed_lines and first_line < changed_lines[-1][1]:
+                # 与上一个编辑落在同一行：合并为一个区间
+                previous_first_line, _, previous_delta = changed_lines[-1]
+                changed_lines[-1] = (previous_first_line, last_line + 1, previous_delta + line_delta)
+            else:
+                changed_lines.append((first_line, last_line + 1, line_delta))
+        return changed_lines
+
+    def apply_edits(self, edits):
+        """一次应用一批 (start, end, replacement) 编辑，坐标均为修改前的当前文档。"""
+        if not edits:
+            return
+        ordered_edits = _resolve_edit_order(edits)
+        if ordered_edits[-1][1] > self._length:
+            raise ValueError(f"编辑区间超出文档范围: [{ordered_edits[-1][0]}, {ordered_edits[-1][1]})")
+        if self.line_changes is not None:
+            self.line_changes.append(self._changed_lines(ordered_edits))
+        new_pieces = []
+        cursor = 0
+        for start, end, replacement in ordered_edits:
+            new_pieces.extend(self._pieces_between(cursor, start))
+            if replacement:
+                new_pieces.append((replacement, 0, len(replacement), replacement.count(self._newline)))
+            cursor = end
+        new_pieces.extend(self._pieces_between(cursor, self._length))
+        # 合并在原始文本中首尾相接的相邻原始片段
+        self._pieces = []
+        for piece in new_pieces:
+            previous = self._pieces[-1] if self._pieces else None
+            if previous and previous[0] is None and piece[0] is None and previous[2] == piece[1]:
+                self._pieces[-1] = (None, previous[1], piece[2], None)
+            else:
+                self._pieces.append(piece)
+        self._rebuild_prefix_sums()
+        self._text = None
+        self.version += 1
+
+    def reset(self, text):
+        """以 text 作为新的原始文本重建文档（整体重写时使用），version 加一；不再记录改动的行。"""
+        self.original_text = text
+        self._pieces = [(None, 0, len(text), None)] if text else []
+        self._original_newline_offsets = None
+        self._text = text
+        self._rebuild_prefix_sums()
+        self.version += 1
+        self.line_changes = None
+
+    def compact(self):
+        """把过碎的文档合并为单个原始片段，内容不变，version 加一（记录的行改动为空）。"""
+        line_changes = self.line_changes
+        self.reset(self.text())
+        if line_changes is not None:
+            self.line_changes = line_changes + [[]]
+
+    def insert(self, offset, text):
+        self.apply_edits([(offset, offset, text)])
+
+    def delete(self, start, end):
+        self.apply_edits([(start, end, "")])
+
+    def replace(self, start, end, text):
+        self.apply_edits([(start, end, text)])
+
+    def line_count(self):
+        self._ensure_line_prefix_sums()
+        return self._line_break_count + 1
+
+    def offset_to_line(self, offset):
+        """偏移量 offset 所在的行号（从 0 开始）。"""
+        if not 0 <= offset <= self._length:
+            raise IndexError(f"偏移量超出文档范围: {offset}")
+        if not self._pieces:
+            return 0
+        self._ensure_line_prefix_sums()
+        piece_idx = bisect.bisect_right(self._piece_starts, offset) - 1
+        inserted_text, piece_start, _, _ = self._pieces[piece_idx]
+        return self._piece_line_starts[piece_idx] + self._count_line_breaks(
+            inserted_text, piece_start, piece_start + offset - self._piece_starts[piece_idx])
+
+    def line_to_offset(self, line_idx):
+        """第 line_idx 行（从 0 开始）的起始偏移量。"""
+        self._ensure_line_prefix_sums()
+        if not 0 <= line_idx <= self._line_break_count:
+            raise IndexError(f"行号超出文档范围: {line_idx}")
+        if line_idx == 0:
+            return 0
+        # 第 line_idx 行从第 line_idx 个换行符之后开始
+        break_idx = line_idx - 1
+        piece_idx = bisect.bisect_right(self._piece_line_starts, break_idx) - 1
+        inserted_text, piece_start, _, _ = self._pieces[piece_idx]
+        break_idx_in_piece = break_idx - self._piece_line_starts[piece_idx]
+        if inserted_text is None:
+            newline_offsets = self._get_original_newline_offsets()
+            newline_pos = newline_offsets[bisect.bisect_left(newline_offsets, piece_start) + break_idx_in_piece]
         else:
-            output_buffer.append(original_code_lines_with_endings[current_original_line_idx])
-            current_original_line_idx += 1
-    
-    if replacements_made_this_pass > 0:
-        _cli_log(f"  2nd round (Iterative): Completed with {replacements_made_this_pass} replacement(s).")
+            newline_pos = inserted_text.index(self._newline, piece_start)
+            for _ in range(break_idx_in_piece):
+                newline_pos = inserted_text.index(self._newline, newline_pos + 1)
+        return self._piece_starts[piece_idx] + newline_pos - piece_start + 1
+
+# --- 第1轮精确匹配引擎 (Aho–Corasick + 仅重扫被改写区域) ---
+
+# 不同 search 字符串达到此数量、且原始文本达到此大小时才用自动机一次扫描整份文档；否则逐个 str.find（C 实现）更快，
+# 纯 Python 的自动机构建与逐字符扫描只有在模式很多、文本很大时才划算。
+_AHO_CORASICK_MIN_PATTERNS = 256
+_AHO_CORASICK_MIN_TEXT_SIZE = 2 << 20
+
+# 平均每这么多个字符就有一处匹配（或一个片段）时视为稠密：逐处编辑片段的 Python 开销超过整体复制，
+# 改为拼出全文后用 str.count + str.replace（C 实现）一次完成，并以结果重建文档。
+_DENSE_EDIT_SPACING = 4096
+
+class _AhoCorasickAutomaton:
+    """Aho–Corasick 多模式自动机：一次扫描找出所有 search 字符串的全部（可重叠）出现位置。
+
+    模式为 bytes 时按字节建立转移（文本可以是 bytes 或 mmap）。
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(pattern for pattern in patterns if pattern))
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for pattern_id, pattern in enumerate(self.patterns):
+            node = 0
+            for ch in pattern:
+                next_node = self._goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[node][ch] = next_node
+                node = next_node
+            self._output[node].append(pattern_id)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail_node = self._fail[node]
+                while fail_node and ch not in self._goto[fail_node]:
+                    fail_node = self._fail[fail_node]
+                self._fail[child] = self._goto[fail_node].get(ch, 0) if node else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+        # 位于根状态时，用字符类正则跳到下一个可能开始匹配的位置，避免逐字符空转。
+        if self.patterns and isinstance(self.patterns[0], bytes):
+            first_chars = b"".join(re.escape(bytes([ch])) for ch in self._goto[0])
+            self._first_char_re = re.compile(b"[" + first_chars + b"]") if first_chars else None
+        else:
+            first_chars = "".join(re.escape(ch) for ch in self._goto[0])
+            self._first_char_re = re.compile("[" + first_chars + "]") if first_chars else None
+
+    def find_all(self, text):
+        """返回 {pattern: 升序起始偏移列表}。"""
+        occurrences = [[] for _ in self.patterns]
+        pattern_lengths = [len(pattern) for pattern in self.patterns]
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        pos = 0
+        text_len = len(text)
+        while pos < text_len:
+            if not node:
+                next_start = self._first_char_re.search(text, pos) if self._first_char_re else None
+                if next_start is None:
+                    break
+                pos = next_start.start()
+            ch = text[pos]
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pattern_id in output[node]:
+                occurrences[pattern_id].append(pos - pattern_lengths[pattern_id] + 1)
+            pos += 1
+        return dict(zip(self.patterns, occurrences))
+
+def _find_all_overlapping(text, pattern, start=0, end=None, max_count=None):
+    if end is None:
+        end = len(text)  # mmap.find 不接受 None
+    positions = []
+    pos = text.find(pattern, start, end)
+    while pos != -1 and len(positions) != max_count:
+        positions.append(pos)
+        pos = text.find(pattern, pos + 1, end)
+    return positions
+
+class _ExactMatchEngine:
+    """第1轮精确匹配引擎，作用于 PieceTable 文档，语义与逐对 current_code.count + current_code.replace 完全一致。
 
-    return "".join(output_buffer), replacements_made_this_pass
+    原始文本中的出现位置只扫描一次（多模式时用 Aho–Corasick）；之后每对只需重扫插入片段
+    以及原始片段接缝附近的区域。第2轮的编辑直接作用于同一个 PieceTable。
+    """
 
-def _extract_delimited_content(text, start_offset_in_text, start_delimiter, end_delimiter):
+    def __init__(self, document, search_strings):
+        self.document = document
+        self._pending_search_strings = [s for s in search_strings if s]
+        self._base_occurrences = {}
+        self._automaton_scanned = False
+        self._views_version = None
+
+    def _automaton_pending(self):
+        return (not self._automaton_scanned and len(self.document.original_text) >= _AHO_CORASICK_MIN_TEXT_SIZE
+                and len(set(self._pending_search_strings)) >= _AHO_CORASICK_MIN_PATTERNS)
+
+    def _occurrences_in_base(self, search_val):
+        if search_val not in self._base_occurrences:
+            original_text = self.document.original_text
+            if self._automaton_pending():
+                self._base_occurrences.update(
+                    _AhoCorasickAutomaton(self._pending_search_strings).find_all(original_text))
+                self._automaton_scanned = True
+            if search_val not in self._base_occurrences:
+                self._base_occurrences[search_val] = _find_all_overlapping(original_text, search_val)
+        return self._base_occurrences[search_val]
+
+    def _get_views(self):
+        # 原始片段按原始偏移单调递增（编辑从不重排片段），可对原始坐标二分查找；
+        # 被改写的区域为插入片段，以及两个不相接的原始片段之间的接缝。
+        document = self.document
+        if self._views_version != document.version:
+            base_starts, base_ends, current_starts, rewritten_spans = [], [], [], []
+            previous_is_original = False
+            for doc_start, (inserted_text, piece_start, piece_end, _) in zip(document.piece_starts, document.pieces):
+                if inserted_text is None:
+                    if previous_is_original:
+                        rewritten_spans.append((doc_start, doc_start))
+                    base_starts.append(piece_start)
+                    base_ends.append(piece_end)
+                    current_starts.append(doc_start)
+                else:
+                    rewritten_spans.append((doc_start, doc_start + piece_end - piece_start))
+                previous_is_original = inserted_text is None
+            self._base_view = (base_starts, base_ends, current_starts)
+            self._rewritten_spans = rewritten_spans
+            self._views_version = document.version
+        return self._base_view, self._rewritten_spans
+
+    def _find_occurrences(self, search_val):
+        """当前文档中 search_val 的全部（可重叠）出现位置，升序。"""
+        base_occurrences = self._occurrences_in_base(search_val)
+        document = self.document
+        if document.version == 0:
+            return base_occurrences
+        search_len = len(search_val)
+        found = set()
+        (base_starts, base_ends, current_starts), rewritten_spans = self._get_views()
+        for pos in base_occurrences:
+            piece_idx = bisect.bisect_right(base_starts, pos) - 1
+            if piece_idx >= 0 and pos + search_len <= base_ends[piece_idx]:
+                found.add(current_starts[piece_idx] + pos - base_starts[piece_idx])
+        # 跨越或落在改写区域内的出现位置只能重新扫描：每个改写区域两侧各扩展 search 长度 - 1 个字符。
+        margin = search_len - 1
+        windows = []
+        for span_start, span_end in rewritten_spans:
+            window_start = max(0, span_start - margin)
+            window_end = min(len(document), span_end + margin)
+            if windows and window_start <= windows[-1][1]:
+                windows[-1][1] = max(windows[-1][1], window_end)
+            else:
+                windows.append([window_start, window_end])
+        for window_start, window_end in windows:
+            if window_end - window_start >= search_len:
+                window_text = document.slice(window_start, window_end)
+                found.update(window_start + pos for pos in _find_all_overlapping(window_text, search_val))
+        return sorted(found)
+
+    def _is_dense(self, search_val):
+        """search_val 在原始文本中的出现是否稠密；未稠密时顺带缓存完整的出现位置，不必再扫描一遍。"""
+        dense_limit = len(self.document) // _DENSE_EDIT_SPACING
+        if search_val in self._base_occurrences or self._automaton_pending():
+            return len(self._occurrences_in_base(search_val)) > dense_limit
+        positions = _find_all_overlapping(self.document.original_text, search_val, max_count=dense_limit + 1)
+        if len(positions) > dense_limit:
+            return True
+        self._base_occurrences[search_val] = positions
+        return False
+
+    def _reset_document(self, text=None):
+        # text 为 None 时只合并片段，内容不变
+        if text is None:
+            self.document.compact()
+        else:
+            self.document.reset(text)
+        self._base_occurrences = {}
+        # 不再重建自动机：合并可能每隔几对就发生一次，每次都为剩余的全部 search 重建并扫描的代价
+        # 远高于之后逐对用 str.find 扫描
+        self._automaton_scanned = True
+
+    def replace_all(self, search_val, replace_val):
+        """等价于 count = code.count(search_val); code = code.replace(search_val, replace_val)，返回 count。"""
+        document = self.document
+        if len(document.pieces) * _DENSE_EDIT_SPACING > len(document):
+            # 片段过碎（大量替换之后）：之后每对都要重扫大量改写区域，先合并为一个原始片段
+            self._reset_document()
+        if search_val and self._is_dense(search_val):
+            text = document.text()
+            if isinstance(text, mmap.mmap):
+                text = text[:]
+            count = text.count(search_val)
+            self._reset_document(text.replace(search_val, replace_val))
+            return count
+        if not search_val:
+            # 与 str.replace 一致：空 search 在每个字符前后各插入一次
+            edits = [(pos, pos, replace_val) for pos in range(len(self.document) + 1)]
+        else:
+            search_len = len(search_val)
+            edits = []
+            next_allowed_start = 0
+            for pos in self._find_occurrences(search_val):
+                if pos >= next_allowed_start:
+                    edits.append((pos, pos + search_len, replace_val))
+                    next_allowed_start = pos + search_len
+        self.document.apply_edits(edits)
+        return len(edits)
+
+# 命令指令的正则只编译一次，并从当前位置直接匹配（pattern.search(text, pos)），不再切片复制剩余文本。
+_SEARCH_DIRECTIVE_RE = re.compile(r"search:\s*《")
+_REPLACE_DIRECTIVE_RE = re.compile(r"replace:\s*《")
+_END_DELIMITER = "》"
+# 单独一行的 "Path:index.html"，指定其后各替换对的目标文件（只在 search/replace 内容之外识别）
+_PATH_DIRECTIVE_RE = re.compile(r"^[ \t]*Path:[ \t]*(\S[^\r\n]*?)[ \t]*$", re.MULTILINE)
+
+
+def _line_column(text, offset):
+    """offset 在 text 中的行号与列号（均从 1 开始），用于定位解析错误；只在出错时计算。"""
+    return text.count('\n', 0, offset) + 1, offset - (text.rfind('\n', 0, offset) + 1) + 1
+
+
+def _emit_parse_problem(context, event_type, text, offset, **fields):
+    line, column = _line_column(text, offset)
+    context.emit(event_type, offset=offset, line=line, column=column, **fields)
+    context.parse_problem_reported = True
+
+
+def _extract_delimited_content(context, text, start_offset_in_text, end_delimiter):
     end_delimiter_pos = text.find(end_delimiter, start_offset_in_text)
     if end_delimiter_pos == -1:
-        _cli_log(f"错误: 从内容开始位置 {start_offset_in_text} (相对于命令字符串的偏移量) 开始，未能找到结束界定符 '{end_delimiter}'。")
+        _emit_parse_problem(context, "delimiter_not_found", text, start_offset_in_text, delimiter=end_delimiter)
         return None, start_offset_in_text 
     content_str = text[start_offset_in_text : end_delimiter_pos]
     return content_str, end_delimiter_pos + len(end_delimiter) 
 
 
-def process_code_modifications_cli(commands_str_raw, original_code):
-    _clear_cli_log() 
-
-    if not commands_str_raw.strip():
-        _cli_log("提示: 命令输入为空，未执行替换。")
-        if original_code and not original_code.endswith('\n') and original_code.strip():
-             original_code += '\n'
-        return {"modified_code": original_code, "log": cli_log_messages}
+def _iter_command_pairs(context, commands_str_raw):
+    """单遍扫描命令文本，逐个产出 (path, search, replace)（search 与 replace 均已 strip）；遇到解析问题时写入日志并停止。
 
-    parsed_commands = []
+    path 为该对之前最近的 Path: 指令给出的路径，之前没有 Path: 指令时为 None。每次匹配都从上一对结束的位置继续，
+    总代价与命令文本的长度成线性。日志事件中的 offset 为字符偏移，另附从 1 开始的 line 与 column。
+    """
     cursor = 0
-    START_DELIMITER = "《"
-    END_DELIMITER = "》"
-
+    path = None
     while cursor < len(commands_str_raw):
-        search_keyword_literal = "search:"
-        replace_keyword_literal = "replace:"
-
-        search_directive_match = re.search(re.escape(search_keyword_literal) + r"\s*" + re.escape(START_DELIMITER), commands_str_raw[cursor:])
+        search_directive_match = _SEARCH_DIRECTIVE_RE.search(commands_str_raw, cursor)
         if not search_directive_match:
             remaining_text_to_check = commands_str_raw[cursor:].strip()
             if remaining_text_to_check and not remaining_text_to_check.startswith("#"): 
-                _cli_log(f"解析提示：在命令文本中，从位置 {cursor} 开始，未找到更多有效的 '{search_keyword_literal}{START_DELIMITER}' 指令。")
-            break 
+                _emit_parse_problem(context, "no_more_directives", commands_str_raw, cursor)
+            return
+        for path_match in _PATH_DIRECTIVE_RE.finditer(commands_str_raw, cursor, search_directive_match.start()):
+            path = path_match.group(1)
         
-        content_start_offset_for_search = cursor + search_directive_match.end()
         search_val_content, cursor_after_search_val_extraction = _extract_delimited_content(
-            commands_str_raw, content_start_offset_for_search, START_DELIMITER, END_DELIMITER 
-        ) 
-
+            context, commands_str_raw, search_directive_match.end(), _END_DELIMITER)
         if search_val_content is None:
-            break 
-        search_val_str = search_val_content.strip() 
+            return
         
-        replace_directive_match = re.search(re.escape(replace_keyword_literal) + r"\s*" + re.escape(START_DELIMITER), commands_str_raw[cursor_after_search_val_extraction:])
+        replace_directive_match = _REPLACE_DIRECTIVE_RE.search(commands_str_raw, cursor_after_search_val_extraction)
         if not replace_directive_match:
-            _cli_log(f"错误：在 '{search_keyword_literal}《{search_val_content[:20]}...》' 内容之后，从位置 {cursor_after_search_val_extraction} 开始，未找到 '{replace_keyword_literal}{START_DELIMITER}' 指令。")
-            break 
-        
-        content_start_offset_for_replace = cursor_after_search_val_extraction + replace_directive_match.end()
-        replace_val_content, cursor_after_replace_val_extraction = _extract_delimited_content(
-            commands_str_raw, content_start_offset_for_replace, START_DELIMITER, END_DELIMITER
-        )
+            _emit_parse_problem(context, "replace_directive_missing", commands_str_raw, cursor_after_search_val_extraction,
+                                search_head=search_val_content[:20])
+            return
         
+        replace_val_content, cursor = _extract_delimited_content(
+            context, commands_str_raw, replace_directive_match.end(), _END_DELIMITER)
         if replace_val_content is None:
-            break
-        replace_val_str = replace_val_content.strip() 
-            
-        parsed_commands.append((search_val_str, replace_val_str))
-        cursor = cursor_after_replace_val_extraction 
+            return
+        yield path, search_val_content.strip(), replace_val_content.strip()
+
+
+def _parse_commands(context, commands_str_raw, with_paths=False):
+    """把命令文本解析为 (search, replace) 列表（with_paths 为真时为 (path, search, replace) 列表）；
+    解析问题写入日志，没有完整命令对时返回空列表。"""
+    if not commands_str_raw.strip():
+        context.emit("commands_empty")
+        return []
+
+    if with_paths:
+        parsed_commands = list(_iter_command_pairs(context, commands_str_raw))
+    else:
+        parsed_commands = [(search_val, replace_val)
+                           for _, search_val, replace_val in _iter_command_pairs(context, commands_str_raw)]
 
     if not parsed_commands and commands_str_raw.strip():
-        log_already_exists = any("解析提示" in msg or "错误" in msg for msg in cli_log_messages)
-        if not log_already_exists:
-             _cli_log("命令解析失败或未找到完整命令对。请确保使用 'search:《内容》 replace:《内容》' 格式，并用书名号《》包裹实际内容。")
-        if original_code and not original_code.endswith('\n') and original_code.strip():
-             original_code += '\n'
-        return {"modified_code": original_code, "log": cli_log_messages}
-    
-    if not parsed_commands: 
-        _cli_log("未在命令区找到有效的 search/replace 对。")
-        if original_code and not original_code.endswith('\n') and original_code.strip():
-             original_code += '\n'
-        return {"modified_code": original_code, "log": cli_log_messages}
+        if not context.parse_problem_reported:
+             context.emit("parse_failed")
+    elif not parsed_commands: 
+        context.emit("no_pairs")
+
+    return parsed_commands
+
+
+def _format_for_log(text):
+    """日志中展示替换内容：换行转义为 \\n，超过 100 个字符时截断。"""
+    return (text[:100].replace('\n', '\\n') + '...') if len(text) > 100 else text.replace('\n', '\\n')
+
+
+def process_code_modifications_cli(commands_str_raw, original_code, output_file=None, log_level="debug", log_format="text",
+                                   collect_metrics=False, trace_file=None, record_dir=None, cache_dir=None,
+                                   cache_max_bytes=None, memory_snapshot=None):
+    """执行命令文本中的全部替换对，返回 {"modified_code", "log"}（指定 output_file 时为 {"output_file", "changed", "log"}，
+    changed 表示文件是否被写入：内容与文件现有内容相同时不写，见 _write_if_changed）。
+
+    log_level / log_format / collect_metrics / trace_file / memory_snapshot 见 _CallContext。record_dir 不为空时把本次的输入与结果
+    录制到该目录（见 _record_run），结果中给出 "record_file"。cache_dir 不为空时使用该目录中的结果缓存
+    （见 _ResultCache，总大小不超过 cache_max_bytes，默认 _RESULT_CACHE_MAX_BYTES）：相同的输入直接返回上次的结果与日志，
+    不运行引擎，结果中的 "from_cache" 表示是否命中。每次调用使用独立的 _CallContext，可在多个线程中并发调用。
+    """
+    context = _CallContext(log_level, log_format, collect_metrics, trace_file, memory_snapshot)
+    return _process_source(context, commands_str_raw, original_code, output_file, record_dir,
+                           _ResultCache.open(cache_dir, cache_max_bytes))
+
+
+def process_code_modifications_file_cli(commands_str_raw, original_file, output_file=None, log_level="debug", log_format="text",
+                                        collect_metrics=False, trace_file=None, record_dir=None, cache_dir=None,
+                                        cache_max_bytes=None, memory_snapshot=None):
+    """与 process_code_modifications_cli 相同，但原始代码来自 UTF-8 文件（'-' 表示标准输入）。
+
+    文件用 mmap 只读映射，第1轮精确匹配直接在字节上进行（UTF-8 自同步，字节匹配与字符匹配结果一致），
+    只有需要第2轮宽松匹配（及其重新缩进）时才把文档解码为 str。缓存的键只取决于文件内容，与
+    process_code_modifications_cli 共用同一缓存目录中的条目。可在多个线程中并发调用。
+    """
+    context = _CallContext(log_level, log_format, collect_metrics, trace_file, memory_snapshot)
+    cache = _ResultCache.open(cache_dir, cache_max_bytes)
+
+    if original_file == '-':
+        return _process_source(context, commands_str_raw, sys.stdin.buffer.read(), output_file, record_dir, cache)
+    with open(original_file, 'rb') as f:
+        # mmap 不能映射空文件；输出写回同一个文件时也不能映射（写入会截断仍在读取的映射）
+        if os.fstat(f.fileno()).st_size == 0 or (
+                output_file and os.path.exists(output_file) and os.path.samefile(original_file, output_file)):
+            original_source = f.read()
+        else:
+            original_source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return _process_source(context, commands_str_raw, original_source, output_file, record_dir, cache)
+        finally:
+            if isinstance(original_source, mmap.mmap):
+                original_source.close()
+
+
+def _process_source(context, commands_str_raw, original_source, output_file, record_dir=None, cache=None):
+    entry = None
+    if cache is not None:
+        lookup_started_at = time.perf_counter()
+        cache_key = cache.key(context, commands_str_raw, original_source)
+        entry = cache.get(cache_key)
+        context.trace("cache_lookup", lookup_started_at, hit=entry is not None)
+    if entry is not None:
+        # 命中：恢复上次运行的日志事件，最终代码作为文档（已含末尾换行）照常输出
+        context.events = [(event_type, fields) for event_type, fields in entry["events"]]
+        document = PieceTable(entry["modified_code"])
+    else:
+        parsed_commands = _parse_commands_timed(context, commands_str_raw)
+        if parsed_commands:
+            document = _apply_parsed_commands(context, parsed_commands, original_source)
+        else:
+            document = PieceTable(original_source)
+    metrics = context.metrics
+    serialize_started_at = time.perf_counter()
+
+    if output_file:
+        # 修改后的代码直接写入文件，不再嵌入 JSON；内容与文件现有内容相同时不写（changed 为假）
+        changed = _write_if_changed(document, output_file, _needs_trailing_newline(document))
+        context.trace("serialize_output", serialize_started_at, output_file=output_file, changed=changed)
+        if metrics is not None:
+            metrics.bytes_copied += document.copied_size
+        fields = {"output_file": output_file, "changed": changed}
+        current_code = _final_code(document) if record_dir or cache is not None else None
+    else:
+        current_code = _final_code(document, metrics)
+        if metrics is not None:
+            metrics.bytes_copied += document.copied_size
+            metrics.peak_document_size = max(metrics.peak_document_size, len(document))
+        context.trace("serialize_output", serialize_started_at)
+        fields = {"modified_code": current_code}
+    if record_dir:
+        fields["record_file"] = _record_run(context, record_dir, commands_str_raw, original_source, current_code)
+    if cache is not None:
+        if entry is None:
+            store_started_at = time.perf_counter()
+            cache.put(cache_key, {"modified_code": current_code, "events": context.events})
+            context.trace("cache_store", store_started_at)
+        fields["from_cache"] = entry is not None
+    return context.result(**fields)
+
+
+def _final_code(document, metrics=None):
+    """文档的最终文本（str，即结果中的 modified_code）：非空、不以换行结尾且含非空白字符时补一个换行。"""
+    current_code = document.text()
+    if not isinstance(current_code, str):
+        current_code = str(current_code, 'utf-8')
+        if metrics is not None:
+            metrics.bytes_copied += len(document)
+    if current_code and not current_code.endswith('\n') and current_code.strip():
+        current_code += '\n'
+    return current_code
+
+
+def _record_run(context, record_dir, commands_str_raw, original_source, modified_code):
+    """把一次运行的 commands、original_code 与 modified_code 保存为 record_dir 中的一个 JSON 文件，返回其路径。
+
+    录制的语料供 bench.py replay 回放：检查输出是否仍与录制时相同，并计时。文件名取输入的 SHA-256，
+    相同的输入只保留第一次录制的结果（之后的运行正是要与它比较）；先写临时文件再改名，不会留下写了一半的记录。
+    """
+    started_at = time.perf_counter()
+    if not isinstance(original_source, str):
+        original_source = str(original_source, 'utf-8')
+    digest = hashlib.sha256(json.dumps([commands_str_raw, original_source], ensure_ascii=False).encode('utf-8'))
+    record_file = os.path.join(record_dir, digest.hexdigest() + ".json")
+    if not os.path.exists(record_file):
+        os.makedirs(record_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=record_dir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"commands": commands_str_raw, "original_code": original_source, "modified_code": modified_code},
+                          f, ensure_ascii=False)
+            os.replace(temp_path, record_file)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    context.trace("record_run", started_at, record_file=record_file)
+    return record_file
+
+
+def _parse_commands_timed(context, commands_str_raw, with_paths=False):
+    """_parse_commands，收集指标时记录解析耗时，开启 trace 时记录解析阶段。"""
+    started_at = time.perf_counter()
+    parsed_commands = _parse_commands(context, commands_str_raw, with_paths)
+    if context.metrics is not None:
+        context.metrics.parse_seconds += time.perf_counter() - started_at
+    context.trace("parse_commands", started_at, pairs=len(parsed_commands))
+    return parsed_commands
+
+
+def _needs_trailing_newline(document):
+    """结果是否需要在末尾补换行：文档非空、不以换行结尾且含非空白字符（与 str.strip() 的判断一致）。"""
+    length = len(document)
+    if not length or document.slice(length - 1, length) in ('\n', b'\n'):
+        return False
+    text = document.text()
+    if isinstance(text, str):
+        return bool(text.strip())
+    # 字节文档：出现任一非空白的 ASCII 字节即可判定；否则（只剩空白或非 ASCII 字符）解码后再判断
+    return re.search(rb'[^\s\x1c-\x1f\x80-\xff]', text) is not None or bool(str(text, 'utf-8').strip())
 
-    _cli_log(f"成功解析 {len(parsed_commands)} 个 search/replace 替换对。开始处理...")
 
-    current_code = original_code
+def _decode_document(document, search_strings):
+    """把字节文档解码为 str 文档，并为剩余的 search 字符串建立新的精确匹配引擎。"""
+    text_document = PieceTable(str(document.text(), 'utf-8'))
+    return text_document, _ExactMatchEngine(text_document, search_strings)
+
+
+def _apply_parsed_commands(context, parsed_commands, original_source):
+    """依次执行各替换对，返回最终的 PieceTable 文档。
+
+    original_source 为 str 时全程在文本上处理；为 bytes/mmap 时第1轮在 UTF-8 字节上匹配，
+    直到某一对需要第2轮（或 search 为空，需按字符插入）时才整体解码为 str 继续。
+    """
+    context.emit("commands_parsed", count=len(parsed_commands), streaming=False)
+
+    search_strings = [search_val for search_val, _ in parsed_commands]
+    is_bytes = not isinstance(original_source, str)
+    document = PieceTable(original_source)
+    exact_engine = _ExactMatchEngine(
+        document, [search_val.encode('utf-8') for search_val in search_strings] if is_bytes else search_strings)
+    # 第2轮的规范化行索引：连续未命中的替换对共享同一份索引；文档被替换修改（version 变化）后
+    # 只重新规范化被改写的行（见 _NormalizedLineIndex.update），无法增量更新时才整体重建。
+    line_index = None
     pair_count = 0
     total_primary_replacements = 0
     total_secondary_replacements = 0
+    metrics = context.metrics
+    if metrics is not None:
+        metrics.peak_document_size = max(metrics.peak_document_size, len(document))
 
     for search_val, replace_val in parsed_commands:
         pair_count += 1
-        _cli_log(f"\n--- 第 {pair_count} 对 ---")
-        log_search_val_display = (search_val[:100].replace('\n', '\\n') + '...') if len(search_val) > 100 else search_val.replace('\n', '\\n')
-        log_replace_val_display = (replace_val[:100].replace('\n', '\\n') + '...') if len(replace_val) > 100 else replace_val.replace('\n', '\\n')
-
-        _cli_log(f"Search (trimmed, for exact match): '{log_search_val_display}'")
-        _cli_log(f"Replace (trimmed): '{log_replace_val_display}'")
+        context.pair_index = pair_count
+        context.emit("pair_start")
+        context.emit("pair_search", search=search_val)
+        context.emit("pair_replace", replace=replace_val)
+        round_1_started_at = time.perf_counter()
         
-        initial_occurrences = current_code.count(search_val)
+        if is_bytes and not search_val:
+            # 空 search 要在每个字符（而非每个字节）前插入，只能在 str 上进行
+            if metrics is not None:
+                metrics.bytes_copied += document.copied_size + len(document)
+            decode_started_at = time.perf_counter()
+            document, exact_engine = _decode_document(document, search_strings[pair_count - 1:])
+            context.trace("decode_document", decode_started_at)
+            is_bytes = False
+        if is_bytes:
+            initial_occurrences = exact_engine.replace_all(search_val.encode('utf-8'), replace_val.encode('utf-8'))
+            if initial_occurrences == 0:
+                # 需要第2轮宽松匹配：此时才把文档解码为 str，剩余的替换对都在文本上处理
+                if metrics is not None:
+                    metrics.bytes_copied += document.copied_size + len(document)
+                decode_started_at = time.perf_counter()
+                document, exact_engine = _decode_document(document, search_strings[pair_count - 1:])
+                context.trace("decode_document", decode_started_at)
+                is_bytes = False
+        else:
+            initial_occurrences = exact_engine.replace_all(search_val, replace_val)
+        round_2_started_at = time.perf_counter()
+        context.trace("round_1", round_1_started_at, round_2_started_at, replacements=initial_occurrences)
+        round_2_replacements_count = 0
         if initial_occurrences > 0:
-            current_code = current_code.replace(search_val, replace_val)
             total_primary_replacements += initial_occurrences
-            _cli_log(f"执行替换 (第1轮 精确匹配): 找到并替换了 {initial_occurrences} 处。")
+            context.emit("round_1_replaced", count=initial_occurrences)
         else:
-            _cli_log(f"第1轮 精确匹配: 未找到 search 字符串 '{log_search_val_display}'。尝试第2轮宽松匹配...")
-            processed_code_round2, round_2_replacements_count = _replace_whitespace_agnostic(current_code, search_val, replace_val)
+            context.emit("round_1_no_match", search=search_val, streaming=False)
+            if line_index is None or line_index.version != document.version:
+                refreshed = line_index.update(document) if line_index is not None else None
+                if refreshed is not None:
+                    refreshed_lines, refreshed_size = refreshed
+                    context.trace("round_2_line_index_update", round_2_started_at, lines=refreshed_lines)
+                    if metrics is not None:
+                        metrics.bytes_copied += refreshed_size
+                        metrics.normalizations += refreshed_lines
+                else:
+                    line_index = _NormalizedLineIndex.for_document(document)
+                    context.trace("round_2_line_index", round_2_started_at, lines=len(line_index.lines))
+                    if metrics is not None:
+                        # 按行切分复制一遍文本，并规范化每一行
+                        metrics.bytes_copied += len(document)
+                        metrics.normalizations += len(line_index.lines)
+            round_2_edits = _whitespace_agnostic_edits(context, line_index, search_val, replace_val)
+            context.memory_checkpoint()  # 行索引与重新缩进后的替换块此时都还存活
+            round_2_replacements_count = len(round_2_edits)
+            if metrics is not None:
+                metrics.lines_scanned += len(line_index.lines)
+                metrics.normalizations += len(search_val.splitlines()) or 1
             if round_2_replacements_count > 0:
-                current_code = processed_code_round2
+                apply_started_at = time.perf_counter()
+                document.apply_edits(round_2_edits)
+                context.trace("round_2_apply", apply_started_at, edits=round_2_replacements_count)
                 total_secondary_replacements += round_2_replacements_count
             else:
-                _cli_log(f"  第2轮 宽松匹配: 也未找到匹配项。此对未执行任何替换。")
+                context.emit("round_2_no_match")
+        context.trace("pair", round_1_started_at)
+        if metrics is not None:
+            finished_at = time.perf_counter()
+            metrics.add_pair(round_2_started_at - round_1_started_at,
+                             finished_at - round_2_started_at if initial_occurrences == 0 else 0.0,
+                             initial_occurrences, round_2_replacements_count)
+            metrics.peak_document_size = max(metrics.peak_document_size, len(document))
+        context.memory_checkpoint()
 
-    if current_code and not current_code.endswith('\n') and current_code.strip():
-        current_code += '\n'
-            
-    _cli_log(f"\n--- 所有替换完成 ---")
-    _cli_log(f"总计: 第1轮替换 {total_primary_replacements} 处, 第2轮替换 {total_secondary_replacements} 处。")
+    context.pair_index = None
+    context.emit("all_done")
+    context.emit("summary", round_1=total_primary_replacements, round_2=total_secondary_replacements)
     
-    return {"modified_code": current_code, "log": cli_log_messages}
+    return document
+
+
+# --- 输出文件：内容未变时不写；变化时先写临时文件再改名 ---
+
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def _output_unchanged(document, path, append_newline):
+    """path 的现有内容是否与文档的输出完全相同：先比较长度，相同时再比较 SHA-256，都不写磁盘。"""
+    try:
+        existing_size = os.stat(path).st_size
+    except FileNotFoundError:
+        return False
+    if not isinstance(document.original_text, str) and len(document) + append_newline != existing_size:
+        return False  # 字节文档的输出长度不必逐片段计算
+    new_digest = hashlib.sha256()
+    new_size = 0
+    for chunk in document.encoded_chunks(append_newline):
+        new_digest.update(chunk)
+        new_size += len(chunk)
+    return new_size == existing_size and new_digest.digest() == _file_sha256(path)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def _fsync_directories(directories):
+    """fsync 各目录，使其中已完成的改名持久化；不支持打开目录的平台（Windows）上跳过。"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    for directory in sorted(directories):
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _write_if_changed(document, path, append_newline=False, pending_directories=None):
+    """把文档的输出写入 path，返回是否写入。
+
+    内容与现有文件相同时不写，文件的 mtime 不变，不会触发下游的重新构建与文件监视。否则先写同一目录下的
+    临时文件并 fsync，再用 os.replace 原子地替换（保留原文件的权限），读者只会看到完整的旧内容或新内容。
+    改名的持久化还需要 fsync 所在目录：pending_directories 为 None 时立即进行；否则把目录加入该集合，
+    由调用方在全部文件写完后调用 _fsync_directories，每个目录只 fsync 一次。
+    """
+    path = os.path.realpath(path)  # 符号链接：替换它指向的文件，而不是链接本身
+    if _output_unchanged(document, path, append_newline):
+        return False
+    temp_path, fd = _create_temp_beside(path)
+    try:
+        with open(fd, 'wb') as f:
+            for chunk in document.encoded_chunks(append_newline):
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        _replace_with_temp(temp_path, path, pending_directories)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return True
+
+
+def _create_temp_beside(path):
+    """在 path 所在目录创建一个新的临时文件（改名替换只能在同一文件系统内原子地进行），返回 (路径, fd)。"""
+    directory, name = os.path.split(path)
+    while True:
+        temp_path = os.path.join(directory, f".{name}.{os.urandom(4).hex()}.tmp")
+        try:
+            # 不用 mkstemp（权限固定为 0600）：按 0666 创建，新文件的权限与直接创建时一样受 umask 约束
+            return temp_path, os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+        except FileExistsError:
+            continue
+
+
+def _replace_with_temp(temp_path, path, pending_directories):
+    """用已写完并 fsync 的临时文件原子地替换 path，保留原文件的权限；目录的 fsync 见 _write_if_changed。"""
+    try:
+        os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode))
+    except FileNotFoundError:
+        pass
+    os.replace(temp_path, path)
+    directory = os.path.dirname(path)
+    if pending_directories is None:
+        _fsync_directories([directory])
+    else:
+        pending_directories.add(directory)
+
+
+# --- 结果缓存 (--cache-dir)：相同的命令与原始代码直接返回上次的结果 ---
+
+# 引擎版本取本文件内容的哈希：代码的任何改动都使旧的缓存条目失效，不必手动维护版本号
+with open(__file__, 'rb') as _engine_source:
+    _ENGINE_VERSION = hashlib.sha256(_engine_source.read()).hexdigest()
+del _engine_source
+_RESULT_CACHE_MAX_BYTES = 256 << 20
+
+
+class _ResultCache:
+    """按内容寻址的结果缓存：键为 (引擎版本, 日志级别, 命令文本, 原始代码) 的 SHA-256，每个条目是 directory 中的
+    一个 JSON 文件，保存最终代码与日志事件。日志格式、metrics、trace 与输出位置不影响条目内容，不计入键。
+
+    条目文件的 mtime 即最近使用时间：命中时更新；写入新条目后总大小超过 max_bytes 时按 mtime 从旧到新删除（LRU）。
+    写入先写临时文件再改名，多个进程可以共用同一目录；条目被其它进程删除或损坏时视为未命中。
+    """
+
+    def __init__(self, directory, max_bytes=_RESULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def open(cls, directory, max_bytes=None):
+        """directory 为空时返回 None（不使用缓存）。"""
+        if not directory:
+            return None
+        return cls(directory, _RESULT_CACHE_MAX_BYTES if max_bytes is None else max_bytes)
+
+    def key(self, context, commands_str_raw, original_source):
+        # 前一部分是完整的 JSON 数组，自身可定界，与其后的原始代码拼接不会产生歧义；
+        # 原始代码按 UTF-8 字节计入，str 与文件（bytes/mmap）形式的相同内容得到相同的键
+        digest = hashlib.sha256(json.dumps([_ENGINE_VERSION, context.log_level, commands_str_raw],
+                                           ensure_ascii=False).encode('utf-8'))
+        digest.update(original_source.encode('utf-8') if isinstance(original_source, str) else original_source)
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """返回条目 {"modified_code", "events"}，未命中时返回 None。"""
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(entry_path)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not isinstance(entry, dict) or not isinstance(entry.get("modified_code"), str) \
+                or not isinstance(entry.get("events"), list):
+            return None
+        return entry
+
+    def put(self, key, entry):
+        data = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+        if len(data) > self.max_bytes:
+            return  # 放不下的条目不缓存，也不为它清空缓存
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self._entry_path(key))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+        with os.scandir(self.directory) as it:
+            for dir_entry in it:
+                if not dir_entry.name.endswith(".json"):
+                    continue
+                try:
+                    entry_stat = dir_entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry_stat.st_mtime_ns, entry_stat.st_size, dir_entry.path))
+                total_size += entry_stat.st_size
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.unlink(entry_path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+# --- 流式模式 (--stream)：文件大于内存时逐块处理 ---
+
+_STREAM_CHUNK_SIZE = 1 << 20
+
+
+def _iter_file_chunks(path, chunk_size=_STREAM_CHUNK_SIZE):
+    """按固定大小分块读取文件（'-' 表示标准输入）并保留原始换行符；不按行切分，压缩成单行的超大文件也能保证内存有界。"""
+    if path == '-':
+        stdin_text = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+        yield from iter(lambda: stdin_text.read(chunk_size), '')
+        return
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        yield from iter(lambda: f.read(chunk_size), '')
+
+
+def _read_text_input(path):
+    """读取整个 UTF-8 文本文件（'-' 表示标准输入），保留原始换行符。"""
+    if path == '-':
+        return sys.stdin.buffer.read().decode('utf-8')
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return f.read()
+
+
+class _StreamingExactReplacer:
+    """单个替换对的流式第1轮精确替换。
+
+    语义与 str.replace 相同（从左到右、互不重叠），但只在片段之间保留 len(search) - 1 个字符的滑动窗口，
+    跨越片段边界的匹配也能找到。
+    """
+
+    def __init__(self, search_val, replace_val):
+        self.search_val = search_val
+        self.replace_val = replace_val
+        self.occurrences = 0
+        self.seconds = 0.0  # 以下两项由 _run_stream_pipeline 累计，供指标使用
+        self.copied_size = 0
+        self._pending = ""
+
+    def feed(self, chunk):
+        """送入下一段文本，返回已经可以确定的输出片段列表。"""
+        if not self.search_val:
+            # 空 search 与 str.replace 一致：在每个字符之前插入 replace，结尾处的那一次留到 finish
+            self.occurrences += len(chunk)
+            return [self.replace_val + self.replace_val.join(chunk)] if chunk else []
+        buffer = self._pending + chunk
+        search_len = len(self.search_val)
+        output = []
+        pos = 0
+        while True:
+            idx = buffer.find(self.search_val, pos)
+            if idx == -1:
+                break
+            output.append(buffer[pos:idx])
+            output.append(self.replace_val)
+            self.occurrences += 1
+            pos = idx + search_len
+        # 末尾 search_len - 1 个字符可能是下一次匹配的开头，暂不输出
+        keep_from = max(pos, len(buffer) - (search_len - 1))
+        output.append(buffer[pos:keep_from])
+        self._pending = buffer[keep_from:]
+        return output
+
+    def finish(self):
+        """输入结束，输出滑动窗口中剩余的文本。"""
+        if not self.search_val:
+            self.occurrences += 1
+            return [self.replace_val]
+        output = [self._pending]
+        self._pending = ""
+        return output
+
+
+def _feed_stage(stage, pieces):
+    text = "".join(pieces)
+    started_at = time.perf_counter()
+    output = stage.feed(text)
+    stage.seconds += time.perf_counter() - started_at
+    stage.copied_size += len(text)
+    return output
+
+
+def _run_stream_pipeline(chunks, stages):
+    """把每个输入块依次送过所有替换对（后一对处理前一对的输出），每个输入块产出一段最终文本。"""
+    for chunk in chunks:
+        pieces = [chunk]
+        for stage in stages:
+            pieces = _feed_stage(stage, pieces)
+        yield "".join(pieces)
+    # 输入结束：按顺序冲刷每一对的窗口，冲刷出的文本仍需经过其后的替换对
+    for i, stage in enumerate(stages):
+        pieces = stage.finish()
+        for later_stage in stages[i + 1:]:
+            pieces = _feed_stage(later_stage, pieces)
+        yield "".join(pieces)
+
+
+def stream_code_modifications_cli(commands_str_raw, original_file, output_file, log_level="debug", log_format="text",
+                                  collect_metrics=False, trace_file=None):
+    """流式处理 original_file 并把结果写入 output_file，内存占用只取决于最长的 search 块，与文件大小无关。
+
+    第2轮宽松匹配的替换范围可以向前覆盖任意多行，无法在有界内存中完成，因此流式模式只执行第1轮精确匹配。
+    结果先写入临时文件，与 output_file 现有内容相同时丢弃（结果中 changed 为假），否则原子地替换它。
+    可在多个线程中并发调用。
+    """
+    context = _CallContext(log_level, log_format, collect_metrics, trace_file)
+
+    parsed_commands = _parse_commands_timed(context, commands_str_raw)
+    if parsed_commands:
+        context.emit("commands_parsed", count=len(parsed_commands), streaming=True)
+    stages = [_StreamingExactReplacer(search_val, replace_val) for search_val, replace_val in parsed_commands]
+
+    last_char = ""
+    has_content = False
+    output_size = 0
+    pipeline_started_at = time.perf_counter()
+    # 结果不能驻留内存，无法在写之前比较：先写入临时文件，与现有内容相同时丢弃，否则改名替换
+    output_path = os.path.realpath(output_file)
+    temp_path, fd = _create_temp_beside(output_path)
+    try:
+        with open(fd, 'w', encoding='utf-8', newline='') as out:
+            for piece in _run_stream_pipeline(_iter_file_chunks(original_file), stages):
+                if not piece:
+                    continue
+                out.write(piece)
+                output_size += len(piece)
+                last_char = piece[-1]
+                if not has_content and piece.strip():
+                    has_content = True
+            if has_content and last_char != '\n':
+                out.write('\n')
+            out.flush()
+            os.fsync(out.fileno())
+        changed = not (os.path.exists(output_path) and os.path.getsize(output_path) == os.path.getsize(temp_path)
+                       and _file_sha256(output_path) == _file_sha256(temp_path))
+        if changed:
+            _replace_with_temp(temp_path, output_path, None)
+        else:
+            os.unlink(temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    # 各替换对在所有输入块上交错执行，无法拆成连续的阶段，只在参数中给出每一对的累计耗时
+    context.trace("stream_pipeline", pipeline_started_at, output_file=output_file, changed=changed,
+                  round_1_seconds=[stage.seconds for stage in stages])
+
+    metrics = context.metrics
+    if metrics is not None:
+        # 流式模式下整份文档从不驻留内存，峰值大小记为输出的字符数
+        metrics.peak_document_size = output_size
+        metrics.bytes_copied = sum(stage.copied_size for stage in stages)
+        for stage in stages:
+            metrics.add_pair(stage.seconds, 0.0, stage.occurrences, 0)
+    if not parsed_commands:
+        return context.result(output_file=output_file, changed=changed)
+
+    total_primary_replacements = 0
+    for pair_count, stage in enumerate(stages, 1):
+        context.pair_index = pair_count
+        context.emit("pair_start")
+        context.emit("pair_search", search=stage.search_val)
+        context.emit("pair_replace", replace=stage.replace_val)
+        if stage.occurrences > 0:
+            total_primary_replacements += stage.occurrences
+            context.emit("round_1_replaced", count=stage.occurrences)
+        else:
+            context.emit("round_1_no_match", search=stage.search_val, streaming=True)
+
+    context.pair_index = None
+    context.emit("all_done")
+    context.emit("summary", round_1=total_primary_replacements, round_2=None)
+
+    return context.result(output_file=output_file, changed=changed)
+
+
+# --- 多文件补丁 (--apply-paths)：按 Path: 指令把替换对分派到各个文件 ---
+
+def _resolve_patch_path(base_dir, path):
+    """Path: 指令中的路径相对于 base_dir 解析为真实路径；不允许指向 base_dir 之外。"""
+    base = os.path.realpath(base_dir)
+    target = os.path.realpath(os.path.join(base, path))
+    if os.path.commonpath([base, target]) != base:
+        raise ValueError(f"Path: {path} 指向 {base_dir} 之外")
+    return target
+
+
+def _patch_file(target, path, pairs, log_level, log_format, collect_metrics, trace_started_at, memory_snapshot=None):
+    """修改一个文件（apply_path_commands_cli 中的一组替换对），返回 (文件结果, trace 事件列表)。
+
+    内容没有变化时不写回（结果中 changed 为假）；目录的 fsync 留给调用方在全部文件写完后统一进行。
+    可以在进程池的工作进程中执行：trace_started_at 不为 None 时用它作为时间零点记录 trace 事件
+    （perf_counter 在同一台机器的各进程间可比），事件随结果返回，由父进程合并。
+    memory_snapshot 只在本进程中串行处理时传入（工作进程中的分配不在父进程的 tracemalloc 追踪范围内）。
+    """
+    file_context = _CallContext(log_level, log_format, collect_metrics, memory_snapshot=memory_snapshot)
+    if trace_started_at is not None:
+        file_context.tracer = _Tracer()
+        file_context.tracer.started_at = trace_started_at
+    started_at = time.perf_counter()
+    with open(target, 'rb') as f:
+        # 结果要写回同一个文件，不能用 mmap 映射（写入会截断仍在读取的映射）
+        original_source = f.read()
+    document = _apply_parsed_commands(file_context, pairs, original_source)
+    changed = _write_if_changed(document, target, _needs_trailing_newline(document), pending_directories=set())
+    if file_context.metrics is not None:
+        file_context.metrics.bytes_copied += document.copied_size
+    file_context.trace("patch_file", started_at, path=path, pairs=len(pairs), changed=changed)
+    return file_context.result(path=path, changed=changed), file_context.tracer.events if file_context.tracer else []
+
+
+def _worker_mp_context():
+    """工作进程池的启动方式：平台支持且当前进程只有一个线程时用 fork，否则用 forkserver（不支持时用 spawn）。
+
+    fork 出的工作进程直接继承已导入的本模块，不必像 spawn 那样为每个进程重新启动解释器并导入 new.py
+    （文件不多时这部分开销往往超过替换本身）。有其他线程时（如 serve 模式的线程化服务器）fork 可能继承
+    被别的线程持有的锁；平台默认方式在 Python 3.14 之前的 Linux 上仍是 fork，因此必须显式选择别的方式。
+    """
+    start_methods = multiprocessing.get_all_start_methods()
+    if "fork" in start_methods and threading.active_count() == 1:
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("forkserver" if "forkserver" in start_methods else "spawn")
+
+
+def apply_path_commands_cli(commands_str_raw, base_dir=".", log_level="debug", log_format="text", collect_metrics=False,
+                            trace_file=None, jobs=1, memory_snapshot=None):
+    """按命令文本中的 Path: 指令修改多个文件：同一文件的替换对按出现顺序依次执行，每个文件只读取、写入一次。
+
+    路径相对于 base_dir，指向同一文件的不同写法合并为一组。任一替换对之前没有 Path: 指令、路径指向 base_dir
+    之外或目标文件不存在时抛出 ValueError，不修改任何文件。返回 {"files": [...], "log"}：log 为命令解析的日志，
+    files 中每个文件的结果为 {"path", "changed", "log"}，各自使用独立的日志（及 metrics），格式与单文件模式相同；
+    内容没有变化的文件不写回（changed 为假），写回的文件所在的目录在最后统一 fsync，每个目录一次。
+    jobs 大于 1 时各文件分派到最多 jobs 个工作进程并行处理（不同文件的替换对互不影响），
+    files 仍按文件在命令中首次出现的顺序排列，与串行处理的结果相同。memory_snapshot 见 _CallContext，
+    只在串行处理时使用。可在多个线程中并发调用（但不应同时修改同一文件）。
+    """
+    if jobs < 1:
+        raise ValueError(f"jobs 至少为 1: {jobs}")
+    context = _CallContext(log_level, log_format, collect_metrics, trace_file, memory_snapshot)
+    parsed_commands = _parse_commands_timed(context, commands_str_raw, with_paths=True)
+
+    groups = {}  # 真实路径 -> (命令中的路径, 替换对列表)，按首次出现的顺序
+    for pair_number, (path, search_val, replace_val) in enumerate(parsed_commands, 1):
+        if path is None:
+            raise ValueError(f"第 {pair_number} 对替换命令之前没有 Path: 指令，无法确定目标文件")
+        target = _resolve_patch_path(base_dir, path)
+        groups.setdefault(target, (path, []))[1].append((search_val, replace_val))
+    missing_paths = [path for target, (path, _) in groups.items() if not os.path.isfile(target)]
+    if missing_paths:
+        raise ValueError(f"目标文件不存在: {', '.join(missing_paths)}")
+
+    trace_started_at = context.tracer.started_at if context.tracer else None
+    tasks = [(target, path, pairs, log_level, log_format, collect_metrics, trace_started_at)
+             for target, (path, pairs) in groups.items()]
+    if jobs > 1 and len(tasks) > 1:
+        # 每个文件一个任务，只传路径与替换对，文件内容由工作进程自己读写；按提交顺序取回结果，顺序确定
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks)), mp_context=_worker_mp_context()) as executor:
+            outcomes = [future.result() for future in [executor.submit(_patch_file, *task) for task in tasks]]
+    else:
+        outcomes = [_patch_file(*task, memory_snapshot=context.memory_snapshot) for task in tasks]
+
+    file_results = []
+    changed_directories = set()
+    for task, (file_result, trace_events) in zip(tasks, outcomes):
+        if context.tracer is not None:
+            context.tracer.events.extend(trace_events)
+        if file_result["changed"]:
+            changed_directories.add(os.path.dirname(task[0]))
+        file_results.append(file_result)
+    fsync_started_at = time.perf_counter()
+    _fsync_directories(changed_directories)
+    context.trace("fsync_directories", fsync_started_at, directories=len(changed_directories))
+    return context.result(files=file_results)
+
+
+# --- 目录批量修改 (codemod)：同一组替换命令应用到目录下所有匹配 glob 的文件 ---
+
+_CODEMOD_CACHE_VERSION = 1
+
+
+def _prefilter_tokens(parsed_commands):
+    """每个替换对取 search 中最长（通常也最少见）的非空白片段，编码为 UTF-8 字节，用于在解码前预筛文件。
+
+    两轮匹配都只在空白上宽松：命中的位置必然原样包含 search 的每个非空白片段。文件中不含任何一对的片段时，
+    第一对不会命中、文档不变，之后各对面对的仍是原文件，因此整组命令都不会修改它。有 search 为空白的
+    替换对（在每个字符前插入）时无法预筛，返回 None。
+    """
+    tokens = []
+    for search_val, _ in parsed_commands:
+        words = search_val.split()
+        if not words:
+            return None
+        tokens.append(max(words, key=len).encode('utf-8'))
+    return tokens
+
+
+def _load_codemod_cache(cache_file):
+    """读取 codemod 缓存；文件不存在、已损坏或版本不符时视为空缓存（缓存只用于加速，不应让运行失败）。"""
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        cache = None
+    if not isinstance(cache, dict) or cache.get("version") != _CODEMOD_CACHE_VERSION:
+        cache = {"version": _CODEMOD_CACHE_VERSION, "command_sets": {}}
+    return cache
+
+
+def _save_codemod_cache(cache_file, cache):
+    """先写临时文件再改名，中断时不会留下写了一半的缓存。"""
+    fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(cache_file)))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            # json.dumps 整体走 C 编码器，比 json.dump 逐块写入快数倍（缓存可有数十万条）
+            f.write(json.dumps(cache, ensure_ascii=False))
+        os.replace(temp_path, cache_file)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def codemod_cli(commands_str_raw, root, pattern, cache_file=None, log_level="debug", log_format="text",
+                collect_metrics=False, trace_file=None):
+    """把同一组替换命令应用到 root 下所有匹配 glob 模式 pattern 的文件（** 匹配任意层目录，不含隐藏文件），
+    只改写内容有变化的文件（写法同 --apply-paths：整份读入，结果经临时文件原子地写回，目录最后统一 fsync）。
+
+    每个文件在解码前先用 _prefilter_tokens 做字节查找，不含任何 search 片段的文件直接跳过。cache_file
+    不为空时，其中按 (root 的绝对路径, 解析后的替换对) 的 SHA-256 分组记录已确认不会被修改的文件的 (size, mtime_ns, sha256)：
+    size 与 mtime 都未变的文件不再读取；mtime 变了（或晚于上次扫描开始、可能在同一时间粒度内又被修改）
+    则读取并比较内容哈希。被修改的文件不记入缓存。
+
+    返回 {"files", "unchanged", "skipped_prefilter", "skipped_cached", "errors", "log"}：files 为被修改文件的结果
+    {"path", "log"}（路径相对于 root，按路径排序），unchanged 为处理后内容不变的文件数，两个 skipped 为
+    被预筛和缓存跳过的文件数，errors 为无法读取、解码或写入的文件 [{"path", "error"}]（不影响其它文件）。
+    """
+    context = _CallContext(log_level, log_format, collect_metrics, trace_file)
+    parsed_commands = _parse_commands_timed(context, commands_str_raw)
+    counts = {"unchanged": 0, "skipped_prefilter": 0, "skipped_cached": 0}
+    file_results = []
+    errors = []
+    if not parsed_commands:
+        return context.result(files=file_results, **counts, errors=errors)
+
+    scan_started_at = time.perf_counter()
+    scan_started_ns = time.time_ns()
+    tokens = _prefilter_tokens(parsed_commands)
+    root_prefix = os.path.join(os.path.abspath(root), "")
+    commands_digest = hashlib.sha256(
+        json.dumps([root_prefix, parsed_commands], ensure_ascii=False).encode('utf-8')).hexdigest()
+    cache = _load_codemod_cache(cache_file) if cache_file else None
+    previous = cache["command_sets"].get(commands_digest, {}) if cache else {}
+    previous_files = previous.get("files", {})
+    trusted_before_ns = previous.get("scanned_at", 0)
+    unchanged_files = {}  # 相对路径 -> [size, mtime_ns, sha256]，本次确认不会被修改的文件
+    changed_directories = set()  # 有文件被改写的目录，最后统一 fsync
+
+    for relative_path in sorted(glob.glob(pattern, root_dir=root, recursive=True)):
+        path = root_prefix + relative_path
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            continue  # 失效的符号链接等
+        if not stat.S_ISREG(file_stat.st_mode):
+            continue
+        file_key = [file_stat.st_size, file_stat.st_mtime_ns]
+        cached = previous_files.get(relative_path)
+        if cached and cached[:2] == file_key and file_stat.st_mtime_ns < trusted_before_ns:
+            unchanged_files[relative_path] = cached
+            counts["skipped_cached"] += 1
+            continue
+        file_started_at = time.perf_counter()
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            content_hash = hashlib.sha256(data).hexdigest()
+            if cached and cached[2] == content_hash:
+                unchanged_files[relative_path] = file_key + [content_hash]
+                counts["skipped_cached"] += 1
+                continue
+            if tokens is not None and not any(token in data for token in tokens):
+                unchanged_files[relative_path] = file_key + [content_hash]
+                counts["skipped_prefilter"] += 1
+                continue
+            file_context = _CallContext(log_level, log_format, collect_metrics)
+            file_context.tracer = context.tracer
+            document = _apply_parsed_commands(file_context, parsed_commands, data)
+            modified = document.text()
+            if modified == (data if isinstance(modified, bytes) else str(data, 'utf-8')):
+                unchanged_files[relative_path] = file_key + [content_hash]
+                counts["unchanged"] += 1
+                continue
+            if not _write_if_changed(document, path, _needs_trailing_newline(document), changed_directories):
+                # 只差末尾补上的换行等，输出与现有内容相同
+                unchanged_files[relative_path] = file_key + [content_hash]
+                counts["unchanged"] += 1
+                continue
+        except (OSError, UnicodeDecodeError) as exc:
+            errors.append({"path": relative_path, "error": str(exc)})
+            continue
+        if file_context.metrics is not None:
+            file_context.metrics.bytes_copied += document.copied_size
+        context.trace("codemod_file", file_started_at, path=relative_path)
+        file_results.append(file_context.result(path=relative_path))
+
+    _fsync_directories(changed_directories)
+    context.trace("codemod_scan", scan_started_at, files=len(file_results) + sum(counts.values()) + len(errors))
+    if cache is not None and unchanged_files != previous_files:
+        # 条目没有变化时保留原来的 scanned_at：其中各文件的 mtime 都早于它，仍然可信
+        cache["command_sets"][commands_digest] = {"scanned_at": scan_started_ns, "files": unchanged_files}
+        _save_codemod_cache(cache_file, cache)
+    return context.result(files=file_results, **counts, errors=errors)
+
+
+def codemod_main(argv):
+    parser = argparse.ArgumentParser(prog="new.py codemod", description="把同一组替换命令应用到目录下所有匹配 glob 模式的文件，只改写内容有变化的文件")
+    commands_group = parser.add_mutually_exclusive_group(required=True)
+    commands_group.add_argument("--commands", help="包含替换命令的字符串，例如: search:《原始》 replace:《替换》")
+    commands_group.add_argument("--commands-file", help="从 UTF-8 文件读取替换命令（'-' 表示标准输入）")
+    parser.add_argument("pattern", help="相对于 --root 的 glob 模式，** 匹配任意层目录，例如 'templates/**/*.html'（需加引号以免被 shell 展开）")
+    parser.add_argument("--root", default=".", help="搜索的根目录（默认当前目录）")
+    parser.add_argument("--cache-file", help="记录已确认不会被修改的文件 (size, mtime, 内容哈希) 的缓存文件，再次运行时跳过这些文件")
+    parser.add_argument("--log-level", choices=list(_LOG_LEVELS), default="debug", help="只记录不低于此级别的日志事件；off 不记录任何日志（默认 debug，记录全部）")
+    parser.add_argument("--log-format", choices=["text", "events"], default="text", help="text: 输出日志文本列表 log；events: 输出结构化事件列表 events")
+    parser.add_argument("--metrics", action="store_true", help="在每个被修改文件的结果中附加 metrics")
+    parser.add_argument("--trace-file", help="把命令解析、扫描与每个被修改文件的各阶段耗时写入此文件（Chrome trace-event 格式）")
+    args = parser.parse_args(argv)
+    commands_str_raw = args.commands if args.commands is not None else _read_text_input(args.commands_file)
+    result = codemod_cli(commands_str_raw, args.root, args.pattern, args.cache_file, args.log_level, args.log_format,
+                         args.metrics, args.trace_file)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    sys.exit(1 if result["errors"] else 0)
+
+
+# --- 批处理模式 (--batch)：一个进程处理多个 NDJSON 任务 ---
+
+def _run_batch_job(job):
+    """执行一个批处理任务并返回结果字典；任务格式与命令行参数一一对应（见 run_batch）。"""
+    if not isinstance(job, dict):
+        raise ValueError("任务必须是 JSON 对象")
+    for key in ("commands", "commands_file", "original_code", "original_file", "output_file", "log_level", "log_format",
+                "trace_file", "record_dir", "base_dir", "cache_dir"):
+        # null 也要拒绝：之后的代码只检查字段是否存在，None 会在引擎深处变成 AttributeError/TypeError
+        if key in job and not isinstance(job[key], str):
+            raise ValueError(f"字段 {key} 必须是字符串")
+    if "cache_max_mb" in job and (not isinstance(job["cache_max_mb"], int) or isinstance(job["cache_max_mb"], bool)
+                                  or job["cache_max_mb"] < 1):
+        raise ValueError("字段 cache_max_mb 必须是正整数")
+    if "cache_max_mb" in job and not job.get("cache_dir"):
+        raise ValueError("cache_max_mb 需要配合 cache_dir 使用")
+    if ("commands" in job) == ("commands_file" in job):
+        raise ValueError("任务必须且只能包含 commands 或 commands_file 之一")
+    if job.get("apply_paths"):
+        if "jobs" in job and (not isinstance(job["jobs"], int) or isinstance(job["jobs"], bool) or job["jobs"] < 1):
+            raise ValueError("字段 jobs 必须是正整数")
+        if any(key in job for key in ("original_code", "original_file", "output_file", "stream", "record_dir", "cache_dir")):
+            raise ValueError("apply_paths 任务按 Path: 指令修改文件，不能再指定 original_code、original_file、output_file、stream、record_dir 或 cache_dir")
+        if job.get("commands_file") == "-":
+            raise ValueError("批处理模式下标准输入用于读取任务，不能用 '-' 作为输入")
+        commands_str_raw = job["commands"] if "commands" in job else _read_text_input(job["commands_file"])
+        return apply_path_commands_cli(commands_str_raw, job.get("base_dir", "."), job.get("log_level", "debug"),
+                                       job.get("log_format", "text"), bool(job.get("metrics", False)), job.get("trace_file"),
+                                       job.get("jobs", 1))
+    if "base_dir" in job or "jobs" in job:
+        raise ValueError("base_dir 与 jobs 只用于 apply_paths 任务")
+    if ("original_code" in job) == ("original_file" in job):
+        raise ValueError("任务必须且只能包含 original_code 或 original_file 之一")
+    if "-" in (job.get("commands_file"), job.get("original_file")):
+        raise ValueError("批处理模式下标准输入用于读取任务，不能用 '-' 作为输入")
+    commands_str_raw = job["commands"] if "commands" in job else _read_text_input(job["commands_file"])
+    output_file = job.get("output_file")
+    log_options = {"log_level": job.get("log_level", "debug"), "log_format": job.get("log_format", "text"),
+                   "collect_metrics": bool(job.get("metrics", False)), "trace_file": job.get("trace_file")}
+
+    if job.get("stream"):
+        if "original_file" not in job or not output_file:
+            raise ValueError("stream 任务需要同时指定 original_file 和 output_file")
+        if job.get("record_dir") or job.get("cache_dir"):
+            raise ValueError("stream 任务不支持 record_dir 与 cache_dir（整份文件不会驻留内存）")
+        return stream_code_modifications_cli(commands_str_raw, job["original_file"], output_file, **log_options)
+    cache_options = {"record_dir": job.get("record_dir"), "cache_dir": job.get("cache_dir"),
+                     "cache_max_bytes": job["cache_max_mb"] << 20 if "cache_max_mb" in job else None}
+    if "original_file" in job:
+        return process_code_modifications_file_cli(commands_str_raw, job["original_file"], output_file, **log_options,
+                                                   **cache_options)
+    return process_code_modifications_cli(commands_str_raw, job["original_code"], output_file, **log_options,
+                                          **cache_options)
+
+
+def run_batch(input_stream, output_stream):
+    """逐行读取 NDJSON 任务，每完成一个任务立即写出一行 NDJSON 结果，返回失败的任务数。
+
+    每个任务是一个 JSON 对象：commands 或 commands_file、original_code 或 original_file，
+    以及可选的 output_file、stream、log_level、log_format、metrics、trace_file、record_dir、
+    cache_dir、cache_max_mb 和 id（原样带回结果中，便于调用方对应）。
+    apply_paths 为真的任务按 commands 中的 Path: 指令修改 base_dir（默认当前目录）下的文件，不需要 original_code/original_file，
+    可选的 jobs 为并行处理文件的工作进程数。
+    单个任务出错（JSON 无效、缺少字段、文件读写失败等）只在该行结果中给出 error，不影响后续任务。
+    """
+    failed_jobs = 0
+    for line_number, line in enumerate(input_stream, 1):
+        if not line.strip():
+            continue
+        result, failed = _execute_job_json(line)
+        if failed:
+            failed_jobs += 1
+            result["error"] = f"第 {line_number} 行{result['error']}"
+        output_stream.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output_stream.flush()
+    return failed_jobs
+
+
+def _execute_job_json(job_json):
+    """解析并执行一个 JSON 任务（str 或 UTF-8 bytes），返回 (结果字典, 是否失败)；失败时结果中给出 error。"""
+    job_id = None
+    try:
+        job = json.loads(job_json)
+        if isinstance(job, dict):
+            job_id = job.get("id")
+        result = dict(_run_batch_job(job))
+        failed = False
+    except (ValueError, OSError) as e:
+        result = {"error": f"任务失败: {e}"}
+        failed = True
+    except Exception as e:
+        # 校验遗漏或引擎缺陷：同样只让这一个任务失败，批处理与常驻服务继续处理后续任务
+        result = {"error": f"任务失败: {type(e).__name__}: {e}"}
+        failed = True
+    if job_id is not None:
+        result = {"id": job_id, **result}
+    return result, failed
+
+
+# --- 常驻服务模式 (serve)：Unix 套接字或标准输入输出上的长度前缀 JSON 协议 ---
+
+# 每帧 = 4 字节大端无符号长度 + 该长度的 UTF-8 JSON；请求与 --batch 的任务相同，响应与其结果相同。
+_FRAME_HEADER = struct.Struct('>I')
+# 单帧负载的上限：不带帧头直接发送 JSON 的客户端，其前 4 个字节会被读成约 2 GB 的长度
+_MAX_FRAME_SIZE = 256 << 20
+
+
+def _read_frame(stream):
+    """读取一帧的 JSON 负载（bytes）；连接在帧边界处关闭时返回 None。"""
+    header = stream.read(_FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < _FRAME_HEADER.size:
+        raise EOFError("帧头不完整，连接被提前关闭")
+    (payload_size,) = _FRAME_HEADER.unpack(header)
+    if payload_size > _MAX_FRAME_SIZE:
+        raise ValueError(f"帧长度 {payload_size} 超过上限 {_MAX_FRAME_SIZE}（帧头应为 4 字节大端长度）")
+    payload = stream.read(payload_size)
+    if len(payload) < payload_size:
+        raise EOFError("帧数据不完整，连接被提前关闭")
+    return payload
+
+
+def _write_frame(stream, message):
+    payload = json.dumps(message, ensure_ascii=False).encode('utf-8')
+    stream.write(_FRAME_HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def _serve_stream(input_stream, output_stream):
+    """在一对二进制流上依次处理请求帧，直到输入结束。
+
+    单个请求出错只在该请求的响应中给出 error（见 _execute_job_json），之后的请求照常处理。帧长度超过上限时
+    回复 error 后结束：此时无法确定下一帧从哪里开始。
+    """
+    while True:
+        try:
+            payload = _read_frame(input_stream)
+        except EOFError:
+            return
+        except ValueError as e:
+            _write_frame(output_stream, {"error": f"请求无效: {e}"})
+            return
+        if payload is None:
+            return
+        result, _ = _execute_job_json(payload)
+        _write_frame(output_stream, result)
+
+
+class _PatchRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            _serve_stream(self.rfile, self.wfile)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def serve_unix_socket(socket_path):
+    """在 Unix 域套接字上提供服务：每个连接一个线程，各连接的请求并发执行，连接内可连续发送多个请求。
+    进程常驻，正则与导入只需准备一次。"""
+    if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        os.unlink(socket_path)  # 上次运行遗留的套接字文件
+    server = socketserver.ThreadingUnixStreamServer(socket_path, _PatchRequestHandler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def serve_main(argv):
+    parser = argparse.ArgumentParser(prog="new.py serve", description="常驻服务模式：长度前缀 JSON 协议（4 字节大端长度 + UTF-8 JSON）")
+    transport_group = parser.add_mutually_exclusive_group(required=True)
+    transport_group.add_argument("--socket", help="监听的 Unix 域套接字路径")
+    transport_group.add_argument("--stdio", action="store_true", help="在标准输入输出上收发帧")
+    args = parser.parse_args(argv)
+    if args.stdio:
+        _serve_stream(sys.stdin.buffer, sys.stdout.buffer)
+    else:
+        # SIGTERM 与 Ctrl+C 一样正常退出，以便清理套接字文件
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            serve_unix_socket(args.socket)
+        except KeyboardInterrupt:
+            pass
+
+
+# --- 性能剖析 (--profile)：cProfile 与 tracemalloc ---
+
+_PROFILE_TOP_N = 25
+
+
+class _PeakMemorySnapshot:
+    """内存剖析期间保存已追踪内存最高时的 tracemalloc 快照。
+
+    run() 返回后临时数据（行索引、第2轮的编辑列表等）早已释放，结束时的快照看不到它们；
+    因此在引擎的阶段边界调用 checkpoint()，只有已追踪内存超过此前最高值时才重新拍快照。
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self.traced_size = -1
+        self._snapshot_overhead = 0  # 保存的快照本身也被追踪，比较时扣除
+
+    def checkpoint(self):
+        traced_size, _ = tracemalloc.get_traced_memory()
+        if traced_size - self._snapshot_overhead <= self.traced_size:
+            return
+        self.snapshot = None
+        traced_size, _ = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        self._snapshot_overhead = tracemalloc.get_traced_memory()[0] - traced_size
+        self.snapshot = snapshot
+        self.traced_size = traced_size
+
+
+def _source_line_owners():
+    """本文件中每一行所属的函数（最内层）名称，用于在内存报告中标出分配发生在哪个引擎阶段。"""
+    with open(__file__, 'r', encoding='utf-8') as f:
+        module_code = compile(f.read(), __file__, 'exec')
+    owners = {}
+    pending_codes = [module_code]
+    while pending_codes:
+        code = pending_codes.pop()
+        for _, _, lineno in code.co_lines():
+            if lineno is not None:
+                owners[lineno] = getattr(code, 'co_qualname', code.co_name)
+        pending_codes.extend(const for const in code.co_consts if isinstance(const, types.CodeType))
+    return owners
+
+
+def _write_tracemalloc_report(snapshot, peak_size, path, top_n=_PROFILE_TOP_N):
+    line_owners = _source_line_owners()
+    this_file = os.path.abspath(__file__)
+    statistics = snapshot.statistics('lineno')
+    with open(path, 'w', encoding='utf-8') as report:
+        report.write(f"tracemalloc 峰值: {peak_size / 1024:.1f} KiB, 快照时（已追踪内存最高的阶段边界）占用: "
+                     f"{sum(stat.size for stat in statistics) / 1024:.1f} KiB\n")
+        report.write(f"按大小排列的前 {top_n} 个分配位置:\n")
+        for rank, stat in enumerate(statistics[:top_n], 1):
+            frame = stat.traceback[0]
+            owner = line_owners.get(frame.lineno, "<module>") if os.path.abspath(frame.filename) == this_file else ""
+            label = f" ({owner})" if owner else ""
+            report.write(f"{rank:3d}. {frame.filename}:{frame.lineno}{label}  "
+                         f"size={stat.size / 1024:.1f} KiB  count={stat.count}\n")
+
+
+def _run_profiled(profile_mode, profile_dir, run):
+    """执行 run(memory_snapshot)；profile_mode 为 cpu/mem/both 时同时剖析，返回 (结果, {"cpu": pstats 路径, "mem": 报告路径})。
+
+    CPU 剖析写 cProfile 的 .pstats 文件（可用 pstats 或 snakeviz 查看）；内存剖析写 tracemalloc 前 N 个分配位置的
+    文本报告，本文件中的位置会标出所属函数（如 _whitespace_agnostic_edits、_reindent_block）。报告取各替换对
+    边界处已追踪内存最高的那份快照，而不是 run() 返回之后的快照：内存剖析时 run 收到本次的 _PeakMemorySnapshot，
+    应传给入口函数（由 _CallContext 带到各步骤），否则为 None。
+    tracemalloc 的追踪是整个进程共用的，因此只供 main 使用；追踪已经开启时（同一进程中另有内存剖析）抛出 RuntimeError。
+    """
+    if not profile_mode:
+        return run(None), {}
+    profile_dir = profile_dir or tempfile.gettempdir()
+    os.makedirs(profile_dir, exist_ok=True)
+    profile_paths = {}
+    profiler = cProfile.Profile() if profile_mode in ("cpu", "both") else None
+    memory_snapshot = None
+    if profile_mode in ("mem", "both"):
+        if tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc 已在追踪（同一进程中另有内存剖析），不能同时进行内存剖析")
+        tracemalloc.start()
+        memory_snapshot = _PeakMemorySnapshot()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = run(memory_snapshot)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        if profiler is not None:
+            fd, profile_paths["cpu"] = tempfile.mkstemp(prefix="new_py_", suffix=".pstats", dir=profile_dir)
+            os.close(fd)
+            profiler.dump_stats(profile_paths["cpu"])
+        if memory_snapshot is not None:
+            memory_snapshot.checkpoint()
+            # 剖析器自身的分配不计入报告
+            snapshot = memory_snapshot.snapshot.filter_traces([
+                tracemalloc.Filter(False, cProfile.__file__), tracemalloc.Filter(False, tracemalloc.__file__)])
+            _, peak_size = tracemalloc.get_traced_memory()
+            fd, profile_paths["mem"] = tempfile.mkstemp(prefix="new_py_", suffix=".tracemalloc.txt", dir=profile_dir)
+            os.close(fd)
+            _write_tracemalloc_report(snapshot, peak_size, profile_paths["mem"])
+    finally:
+        if memory_snapshot is not None:
+            tracemalloc.stop()
+    return result, profile_paths
 
 
 def main():
-    parser = argparse.ArgumentParser(description="代码批量替换命令行工具")
-    parser.add_argument("--commands", required=True, help="包含替换命令的字符串，例如: search:《原始》 replace:《替换》")
-    parser.add_argument("--original_code", required=True, help="待处理的原始代码字符串")
+    if sys.argv[1:2] == ["serve"]:
+        serve_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["codemod"]:
+        codemod_main(sys.argv[2:])
+        return
+    parser = argparse.ArgumentParser(description="代码批量替换命令行工具（new.py serve --help 查看常驻服务模式，new.py codemod --help 查看目录批量修改）")
+    commands_group = parser.add_mutually_exclusive_group()
+    commands_group.add_argument("--commands", help="包含替换命令的字符串，例如: search:《原始》 replace:《替换》")
+    commands_group.add_argument("--commands-file", help="从 UTF-8 文件读取替换命令（'-' 表示标准输入），不受命令行参数长度限制")
+    original_group = parser.add_mutually_exclusive_group()
+    original_group.add_argument("--original_code", help="待处理的原始代码字符串")
+    original_group.add_argument("--original-file", help="待处理的原始文件路径（UTF-8，'-' 表示标准输入），文件用 mmap 读取")
+    original_group.add_argument("--apply-paths", action="store_true", help="按命令中的 Path: 指令直接修改各个文件（相对 --base-dir），每个文件只读写一次")
+    parser.add_argument("--base-dir", help="--apply-paths 中 Path: 路径的基准目录（默认当前目录），路径不能指向其外")
+    parser.add_argument("--jobs", type=int, help="--apply-paths 中并行处理文件的工作进程数（默认 1，即串行）；结果顺序与串行相同")
+    parser.add_argument("--output-file", help="修改后的代码直接写入此文件，输出的 JSON 中不再包含 modified_code")
+    parser.add_argument("--stream", action="store_true", help="流式处理 --original-file 并写入 --output-file，适用于大于内存的文件（仅执行第1轮精确匹配）")
+    parser.add_argument("--batch", action="store_true", help="从标准输入逐行读取 NDJSON 任务，每完成一个任务输出一行 NDJSON 结果")
+    parser.add_argument("--log-level", choices=list(_LOG_LEVELS), default="debug", help="只记录不低于此级别的日志事件；off 不记录任何日志（默认 debug，记录全部）")
+    parser.add_argument("--log-format", choices=["text", "events"], default="text", help="text: 输出日志文本列表 log；events: 输出结构化事件列表 events")
+    parser.add_argument("--metrics", action="store_true", help="在输出的 JSON 中附加 metrics：各阶段与每个替换对的耗时、扫描行数、复制量等")
+    parser.add_argument("--trace-file", help="把各阶段（命令解析、每个替换对的两轮匹配、重新缩进、输出）的耗时写入此文件，Chrome trace-event 格式，可用 chrome://tracing 或 Perfetto 打开")
+    parser.add_argument("--record-dir", help="把本次的命令、原始代码与结果录制为此目录中的一个 JSON 文件，供 bench.py replay 回放（不能与 --stream 同用）")
+    parser.add_argument("--cache-dir", help="结果缓存目录：相同的命令与原始代码直接返回上次的结果与日志，不再运行引擎（输出 JSON 的 from_cache 表示是否命中）")
+    parser.add_argument("--cache-max-mb", type=int, help=f"结果缓存的总大小上限，超过时淘汰最久未用的条目（默认 {_RESULT_CACHE_MAX_BYTES >> 20} MB）")
+    parser.add_argument("--profile", choices=["cpu", "mem", "both"], help="剖析本次运行：cpu 写 cProfile 的 .pstats，mem 写 tracemalloc 分配报告，文件路径见输出 JSON 的 profile")
+    parser.add_argument("--profile-dir", help="剖析文件的输出目录（默认系统临时目录）")
     
     args = parser.parse_args()
-    results = process_code_modifications_cli(args.commands, args.original_code)
+    if args.batch:
+        if any(value is not None for value in (args.commands, args.commands_file, args.original_code,
+                                                 args.original_file, args.output_file)) or args.stream \
+                or args.log_level != "debug" or args.log_format != "text" or args.metrics \
+                or args.trace_file or args.record_dir or args.profile or args.apply_paths or args.base_dir \
+                or args.cache_dir or args.cache_max_mb is not None \
+                or args.jobs is not None:
+            parser.error("--batch 模式的所有参数都在任务 JSON 中给出，不能再指定其它参数")
+        stdin_text = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+        stdout_text = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        sys.exit(1 if run_batch(stdin_text, stdout_text) else 0)
+    if args.commands is None and args.commands_file is None:
+        parser.error("需要指定 --commands 或 --commands-file")
+    if args.original_code is None and args.original_file is None and not args.apply_paths:
+        parser.error("需要指定 --original_code、--original-file 或 --apply-paths")
+    if args.apply_paths and (args.output_file or args.stream or args.record_dir or args.cache_dir):
+        parser.error("--apply-paths 直接修改 Path: 指定的文件，不能与 --output-file、--stream、--record-dir 或 --cache-dir 同时使用")
+    if (args.base_dir or args.jobs is not None) and not args.apply_paths:
+        parser.error("--base-dir 与 --jobs 需要配合 --apply-paths 使用")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs 至少为 1")
+    if args.commands_file == '-' and args.original_file == '-':
+        parser.error("--commands-file 与 --original-file 不能同时从标准输入读取")
+    commands_str_raw = args.commands if args.commands is not None else _read_text_input(args.commands_file)
+
+    if args.stream and (not args.original_file or not args.output_file):
+        parser.error("--stream 需要同时指定 --original-file 和 --output-file")
+    if args.stream and (args.record_dir or args.cache_dir):
+        parser.error("--record-dir 与 --cache-dir 不能与 --stream 同时使用（流式模式下整份文件不会驻留内存）")
+    if args.cache_max_mb is not None and (not args.cache_dir or args.cache_max_mb < 1):
+        parser.error("--cache-max-mb 需要配合 --cache-dir 使用，且至少为 1")
+    if args.profile_dir and not args.profile:
+        parser.error("--profile-dir 需要配合 --profile 使用")
+
+    cache_max_bytes = args.cache_max_mb << 20 if args.cache_max_mb is not None else None
+
+    def run(memory_snapshot):
+        if args.apply_paths:
+            return apply_path_commands_cli(commands_str_raw, args.base_dir or ".", args.log_level, args.log_format,
+                                           args.metrics, args.trace_file, args.jobs or 1, memory_snapshot)
+        if args.stream:
+            return stream_code_modifications_cli(commands_str_raw, args.original_file, args.output_file,
+                                                 args.log_level, args.log_format, args.metrics, args.trace_file)
+        if args.original_file:
+            return process_code_modifications_file_cli(commands_str_raw, args.original_file, args.output_file,
+                                                       args.log_level, args.log_format, args.metrics, args.trace_file,
+                                                       args.record_dir, args.cache_dir, cache_max_bytes, memory_snapshot)
+        return process_code_modifications_cli(commands_str_raw, args.original_code, args.output_file,
+                                              args.log_level, args.log_format, args.metrics, args.trace_file,
+                                              args.record_dir, args.cache_dir, cache_max_bytes, memory_snapshot)
+
+    try:
+        results, profile_paths = _run_profiled(args.profile, args.profile_dir, run)
+    except ValueError as exc:
+        # 如 --apply-paths 的 Path: 指令缺失、越界或目标文件不存在（此时没有修改任何文件）
+        parser.error(str(exc))
+    if profile_paths:
+        results["profile"] = profile_paths
     print(json.dumps(results, ensure_ascii=False, indent=2))
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+import argparse
+import gc
+import json
+import math
+import re
+import statistics
+import sys
+
+import new
+from bench import _code_line, load_gui_module, make_headless_app, time_call
+
+# --- 被测的第2轮宽松匹配：new.py 与 300.替换CLINE.py 各自的 _replace_whitespace_agnostic ---
+
+def _cli_matcher(code, search_block, replace_block):
+    return new._replace_whitespace_agnostic(new._CallContext(log_level="off"), code, search_block, replace_block)
+
+
+def _make_gui_matcher(gui_module):
+    def gui_matcher(code, search_block, replace_block):
+        # 每次新建 app，日志不会在多次运行之间累积
+        return make_headless_app(gui_module)._replace_whitespace_agnostic(code, search_block, replace_block)
+    return gui_matcher
+
+
+def available_matchers():
+    matchers = {"cli": _cli_matcher}
+    gui_module = load_gui_module()
+    if gui_module is None:
+        print("提示: 无法导入 tkinter，跳过图形界面版引擎 (gui)。", file=sys.stderr)
+    else:
+        matchers["gui"] = _make_gui_matcher(gui_module)
+    return matchers
+
+
+# --- 输入：每个函数按行数 n 生成 (原始代码, search 块, replace 块) ---
+
+def case_typical(n):
+    """普通代码，空白与 search 不同，只有一处匹配。"""
+    code = "\n".join(_code_line(i).replace(" = ", "  =  ") for i in range(n)) + "\n"
+    middle = n // 2
+    search_block = "\n".join(_code_line(i).strip() for i in range(middle, middle + 3))
+    return code, search_block, "replaced()"
+
+
+def case_many_matches(n):
+    """同一个三行块重复 n/3 次，每一处都匹配，替换次数与输出都随 n 线性增长。"""
+    code = "if  ready:\n    run( 1 )\n  done()\n" * (n // 3)
+    return code, "if ready:\nrun( 1 )\ndone()", "if ready:\n    run(2)"
+
+
+def case_anchors_no_match(n):
+    """每一行都等于 search 首行（都是锚点），search 的前 49 行处处匹配、直到最后一行才失败。"""
+    code = "    x  =  1\n" * n
+    return code, "x = 1\n" * 49 + "y = 2", "z = 3"
+
+
+def case_long_search_prefix(n):
+    """search 块的长度也随 n 增长（n/2 行），且其前缀在每个位置都匹配：逐位置比较的实现为 O(n²)。"""
+    code = "x = 1\n" * n
+    return code, "x = 1\n" * (n // 2) + "y = 2", "z = 3"
+
+
+def case_blank_runs(n):
+    """内容行之间隔着长串空行（约 n/20 个内容行），内容行全是锚点，search 跨越空行后在最后一行失败。"""
+    code = ("  a\n" + "\n" * 19) * (n // 20)
+    return code, "a\n" * 10 + "b", "c"
+
+
+def case_blank_prefix(n):
+    """n 个空行之后才出现唯一的匹配：替换范围从第 1 行一直覆盖到匹配末行。"""
+    code = "   \n" * n + "    target( 1 )\n    next()\n"
+    return code, "target( 1 )\nnext()", "done()"
+
+
+SCALING_CASES = {
+    "typical": case_typical,
+    "many_matches": case_many_matches,
+    "anchors_no_match": case_anchors_no_match,
+    "long_search_prefix": case_long_search_prefix,
+    "blank_runs": case_blank_runs,
+    "blank_prefix": case_blank_prefix,
+}
+
+
+# --- 测量与拟合 ---
+
+def fit_exponent(sizes, seconds):
+    """对 log(耗时) ~ log(规模) 做最小二乘拟合，返回斜率，即增长指数（线性约为 1，平方约为 2）。"""
+    slope, _ = statistics.linear_regression([math.log(n) for n in sizes], [math.log(t) for t in seconds])
+    return slope
+
+
+# 短于此值的计时主要反映调度、缓存与垃圾回收的噪声（几毫秒的抖动足以把指数从 1.2 推到 1.3 以上），不参与拟合
+MIN_FIT_SECONDS = 0.02
+# 最小规模过快时，整组规模最多翻倍的次数
+_MAX_SIZE_SHIFTS = 6
+
+
+def _min_seconds(matcher, case, n, repeat):
+    """在规模 n 上运行 repeat 次，返回最小耗时（最不受噪声影响）；计时期间关闭垃圾回收。"""
+    inputs = case(n)
+    gc.collect()
+    gc.disable()
+    try:
+        timings, _ = time_call(matcher, inputs, repeat)
+    finally:
+        gc.enable()
+    return max(min(timings), 1e-9)
+
+
+def measure_scaling(matcher, case, sizes, repeat, min_seconds=MIN_FIT_SECONDS):
+    """返回 (实际规模, 各规模耗时, 拟合的增长指数)。
+
+    最小规模的耗时不足 min_seconds 时整组规模翻倍（至多 _MAX_SIZE_SHIFTS 次），
+    使参与拟合的每个规模都足够慢，便宜的输入不会因噪声而误报。
+    """
+    sizes = list(sizes)
+    first_seconds = _min_seconds(matcher, case, sizes[0], repeat)
+    for _ in range(_MAX_SIZE_SHIFTS):
+        if first_seconds >= min_seconds:
+            break
+        sizes = [n * 2 for n in sizes]
+        first_seconds = _min_seconds(matcher, case, sizes[0], repeat)
+    seconds = [first_seconds] + [_min_seconds(matcher, case, n, repeat) for n in sizes[1:]]
+    return sizes, seconds, fit_exponent(sizes, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="第2轮宽松匹配的复杂度回归检查：在成倍增长的输入上计时，拟合增长指数，超过阈值即失败")
+    parser.add_argument("--start", type=int, default=4000,
+                        help=f"最小输入的行数（默认 4000；耗时不足 {MIN_FIT_SECONDS * 1000:.0f} ms 的输入自动翻倍）")
+    parser.add_argument("--doublings", type=int, default=5, help="规模翻倍的次数（默认 5，即 6 个规模）")
+    parser.add_argument("--repeat", type=int, default=3, help="每个规模运行的次数，取最小值（默认 3）")
+    parser.add_argument("--threshold", type=float, default=1.3, help="允许的最大增长指数（默认 1.3；线性约为 1，平方约为 2）")
+    parser.add_argument("--filter", help="只运行名称匹配此正则的输入，例如 anchors")
+    parser.add_argument("--engines", default="cli,gui", help="逗号分隔的引擎名称：cli、gui（默认两者）")
+    parser.add_argument("--output", help="把各规模的耗时与拟合结果以 JSON 写入此文件")
+    args = parser.parse_args()
+    if args.start < 20 or args.doublings < 1 or args.repeat < 1:
+        parser.error("--start 至少为 20，--doublings 与 --repeat 至少为 1")
+
+    sizes = [args.start << i for i in range(args.doublings + 1)]
+    matchers = {name: matcher for name, matcher in available_matchers().items() if name in args.engines.split(",")}
+    results = []
+    for case_name, case in SCALING_CASES.items():
+        if args.filter and not re.search(args.filter, case_name):
+            continue
+        for engine_name, matcher in matchers.items():
+            case_sizes, seconds, exponent = measure_scaling(matcher, case, sizes, args.repeat)
+            passed = exponent <= args.threshold
+            results.append({"case": case_name, "engine": engine_name, "sizes": case_sizes, "seconds": seconds,
+                            "exponent": exponent, "passed": passed})
+            timings_ms = " ".join(f"{t * 1000:8.2f}" for t in seconds)
+            print(f"{engine_name:4} {case_name:20} 指数 {exponent:5.2f} {'通过' if passed else '失败'}  "
+                  f"{case_sizes[0]}-{case_sizes[-1]} 行  ms: {timings_ms}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"threshold": args.threshold, "results": results}, f, ensure_ascii=False, indent=2)
+    failures = [r for r in results if not r["passed"]]
+    if failures:
+        print(f"{len(failures)} 项的增长指数超过 {args.threshold}："
+              + ", ".join(f"{r['engine']}/{r['case']} ({r['exponent']:.2f})" for r in failures), file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
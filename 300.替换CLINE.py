@@ -1,6 +1,9 @@
 import tkinter as tk
 from tkinter import scrolledtext, messagebox, simpledialog, Toplevel, Entry, Button, Label, PanedWindow, Frame
+import importlib.util
+import os
 import re
+import sys
 
 # --- 行号显示类 (LineNumbers Class)  
 class LineNumbers(tk.Canvas):
@@ -72,6 +75,33 @@ class LineNumbers(tk.Canvas):
             if self.textwidget.compare(current_line_index_str, ">=", tk.END):
                 break
 
+# --- 替换引擎：与命令行版共用 0.insert/new.py ---
+
+# The document model and the matching engines (PieceTable, the round-1 exact-match engine, the normalized line
+# index) live in 0.insert/new.py, loaded by path (its directory is not a package). An already imported `new`
+# from that file is reused, so both front ends always run the same module.
+_ENGINE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "0.insert", "new.py")
+
+def _load_engine_module():
+    module = sys.modules.get("new")
+    if module is not None and os.path.realpath(getattr(module, "__file__", "")) == os.path.realpath(_ENGINE_SCRIPT):
+        return module
+    spec = importlib.util.spec_from_file_location("new", _ENGINE_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+_engine = _load_engine_module()
+_WHITESPACE_RUN_RE = _engine._WHITESPACE_RUN_RE
+_NormalizedLineIndex = _engine._NormalizedLineIndex
+_kmp_find_all = _engine._kmp_find_all
+_apply_edits_to_text = _engine._apply_edits_to_text
+PieceTable = _engine.PieceTable
+_ExactMatchEngine = _engine._ExactMatchEngine
+_SEARCH_DIRECTIVE_RE = _engine._SEARCH_DIRECTIVE_RE
+_REPLACE_DIRECTIVE_RE = _engine._REPLACE_DIRECTIVE_RE
+_line_column = _engine._line_column
+
 class CodeModifierApp:
     def __init__(self, root):
         self.root = root
@@ -261,7 +291,7 @@ class CodeModifierApp:
     def _normalize_text_block(self, text_block):
         lines = text_block.splitlines()
         stripped_lines = [line.strip() for line in lines]
-        whitespace_removed_lines = [re.sub(r'\s+', '', line) for line in stripped_lines]
+        whitespace_removed_lines = [_WHITESPACE_RUN_RE.sub('', line) for line in stripped_lines]
         normalized_lines = [line for line in whitespace_removed_lines if line]
         return normalized_lines
 
@@ -325,98 +355,81 @@ class CodeModifierApp:
 
         return "\n".join(processed_lines)
 
-    # OPTIMIZED iterative whitespace-agnostic replacement function
-    def _replace_whitespace_agnostic(self, code_to_search_in, search_block_query, replace_block_content):
+    # OPTIMIZED iterative whitespace-agnostic matching: returns (start, end, replacement) edits, ascending,
+    # against the document line_index was built from
+    def _whitespace_agnostic_edits(self, line_index, search_block_query, replace_block_content):
         self._log("  Attempting 2nd round: Iterative Whitespace-agnostic multi-line search...")
         normalized_search_lines = self._normalize_text_block(search_block_query)
 
         if not normalized_search_lines:
             self._log("  2nd round: Search block is effectively empty after normalization. Skipping.")
-            return code_to_search_in, 0
-
-        original_code_lines_with_endings = code_to_search_in.splitlines(True)
-        output_buffer = []
+            return []
+
+        original_code_lines_with_endings = line_index.lines
+        line_offsets = line_index.line_offsets
+        content_line_indices = line_index.content_line_indices
+        num_search_lines = len(normalized_search_lines)
+        # All full matches over the content-line sequence (blank lines skipped) in one KMP pass: O(N + M)
+        match_start_positions = set(_kmp_find_all(line_index.content_normalized_lines, normalized_search_lines))
+        edits = []
         current_original_line_idx = 0
-        replacements_made_this_pass = 0
 
-        while current_original_line_idx < len(original_code_lines_with_endings):
-            match_found_here = False
-            
-            normalized_search_ptr = 0
-            temp_scan_original_idx = current_original_line_idx
+        # A scan starting at the current line skips blank lines and must match on the first content line it
+        # meets. On a match, the block [current line, last matched line] is replaced; otherwise every line up
+        # to and including that content line is kept as is.
+        for content_pos, first_content_line_idx in enumerate(content_line_indices):
+            if first_content_line_idx < current_original_line_idx:
+                continue
+            if content_pos not in match_start_positions:
+                current_original_line_idx = first_content_line_idx + 1
+                continue
+
+            end_of_matched_original_block_idx = content_line_indices[content_pos + num_search_lines - 1]
             
-            first_content_line_in_matched_block_original_idx = -1
-            # This will store the end index of the original block that was matched
-            end_of_matched_original_block_idx = -1 
-
-            # Scan ahead to find a potential match
-            block_scan_idx = temp_scan_original_idx
-            while block_scan_idx < len(original_code_lines_with_endings) and \
-                  normalized_search_ptr < len(normalized_search_lines):
-                
-                current_original_line_text = original_code_lines_with_endings[block_scan_idx]
-                normalized_original_line_list = self._normalize_text_block(current_original_line_text)
-
-                if normalized_original_line_list: # Current original line has content
-                    if normalized_original_line_list[0] == normalized_search_lines[normalized_search_ptr]:
-                        if first_content_line_in_matched_block_original_idx == -1:
-                            first_content_line_in_matched_block_original_idx = block_scan_idx
-                        normalized_search_ptr += 1
-                        if normalized_search_ptr == len(normalized_search_lines): 
-                            match_found_here = True
-                            end_of_matched_original_block_idx = block_scan_idx 
-                            break 
-                    else: 
-                        break # Content mismatch
-                # If original line is blank, it's consumed as part of the potential block being matched.
-                # The `normalized_search_ptr` only advances on content lines.
-                block_scan_idx += 1
+            start_of_block_to_replace_idx = current_original_line_idx # The first line considered for this match attempt
             
-            if match_found_here:
-                replacements_made_this_pass += 1
-                
-                start_of_block_to_replace_idx = current_original_line_idx # The first line considered for this match attempt
-                
-                self._log(f"  2nd round: Found whitespace-agnostic match. Original lines "
-                          f"{start_of_block_to_replace_idx + 1} through {end_of_matched_original_block_idx + 1}.")
-
-                indent_ref_idx = first_content_line_in_matched_block_original_idx \
-                                 if first_content_line_in_matched_block_original_idx != -1 \
-                                 else start_of_block_to_replace_idx
-                
-                target_indent = self._get_line_indentation(original_code_lines_with_endings[indent_ref_idx])
-                reindented_replace_block_str = self._reindent_block(replace_block_content, target_indent)
-
-                if reindented_replace_block_str and '\n' in replace_block_content and not reindented_replace_block_str.endswith('\n'):
-                    # Attempt to preserve original line ending style of the last line of the replaced block
-                    last_line_of_replaced_block = original_code_lines_with_endings[end_of_matched_original_block_idx]
-                    if last_line_of_replaced_block.endswith('\r\n'):
-                        reindented_replace_block_str += '\r\n'
-                    elif last_line_of_replaced_block.endswith('\n'):
-                        reindented_replace_block_str += '\n'
-                    else: # Fallback
-                         reindented_replace_block_str += '\n'
-                elif not reindented_replace_block_str and replace_block_content: # If reindented is empty but original replace wasn't
-                    pass # Do nothing, effectively deleting if replace_block_content was just whitespace
-                elif not replace_block_content: # If replace block is truly empty
-                     reindented_replace_block_str = ""
-
-
-                output_buffer.append(reindented_replace_block_str)
-                current_original_line_idx = end_of_matched_original_block_idx + 1
-            else:
-                output_buffer.append(original_code_lines_with_endings[current_original_line_idx])
-                current_original_line_idx += 1
-        
-        if replacements_made_this_pass > 0:
-            self._log(f"  2nd round (Iterative): Completed with {replacements_made_this_pass} replacement(s).")
-
-        return "".join(output_buffer), replacements_made_this_pass
+            self._log(f"  2nd round: Found whitespace-agnostic match. Original lines "
+                      f"{start_of_block_to_replace_idx + 1} through {end_of_matched_original_block_idx + 1}.")
+
+            target_indent = self._get_line_indentation(original_code_lines_with_endings[first_content_line_idx])
+            reindented_replace_block_str = self._reindent_block(replace_block_content, target_indent)
+
+            if reindented_replace_block_str and '\n' in replace_block_content and not reindented_replace_block_str.endswith('\n'):
+                # Attempt to preserve original line ending style of the last line of the replaced block
+                last_line_of_replaced_block = original_code_lines_with_endings[end_of_matched_original_block_idx]
+                if last_line_of_replaced_block.endswith('\r\n'):
+                    reindented_replace_block_str += '\r\n'
+                elif last_line_of_replaced_block.endswith('\n'):
+                    reindented_replace_block_str += '\n'
+                else: # Fallback
+                     reindented_replace_block_str += '\n'
+            elif not reindented_replace_block_str and replace_block_content: # If reindented is empty but original replace wasn't
+                pass # Do nothing, effectively deleting if replace_block_content was just whitespace
+            elif not replace_block_content: # If replace block is truly empty
+                 reindented_replace_block_str = ""
+
+            edits.append((line_offsets[start_of_block_to_replace_idx],
+                          line_offsets[end_of_matched_original_block_idx + 1],
+                          reindented_replace_block_str))
+            current_original_line_idx = end_of_matched_original_block_idx + 1
+
+        if edits:
+            self._log(f"  2nd round (Iterative): Completed with {len(edits)} replacement(s).")
+
+        return edits
+
+    # String form of round 2: returns (new code, replacement count)
+    def _replace_whitespace_agnostic(self, code_to_search_in, search_block_query, replace_block_content, line_index=None):
+        if line_index is None:
+            line_index = _NormalizedLineIndex(code_to_search_in, whitespace_replacement='')
+        edits = self._whitespace_agnostic_edits(line_index, search_block_query, replace_block_content)
+        return _apply_edits_to_text(code_to_search_in, edits), len(edits)
 
     def _extract_delimited_content(self, text, start_offset_in_text, start_delimiter, end_delimiter):
         end_delimiter_pos = text.find(end_delimiter, start_offset_in_text)
         if end_delimiter_pos == -1:
-            self._log(f"错误: 从位置 {start_offset_in_text} 开始，未能找到结束界定符 '{end_delimiter}'。")
+            line, column = _line_column(text, start_offset_in_text)
+            self._log(f"错误: 从位置 {start_offset_in_text} (第 {line} 行第 {column} 列) 开始，未能找到结束界定符 '{end_delimiter}'。")
             return None, start_offset_in_text
         content_str = text[start_offset_in_text : end_delimiter_pos]
         return content_str, end_delimiter_pos + len(end_delimiter)
@@ -451,13 +464,14 @@ class CodeModifierApp:
             search_keyword_literal = "search:"
             replace_keyword_literal = "replace:"
 
-            search_directive_match = re.search(re.escape(search_keyword_literal) + r"\s*" + re.escape(START_DELIMITER), commands_str_raw[cursor:])
+            search_directive_match = _SEARCH_DIRECTIVE_RE.search(commands_str_raw, cursor)
             if not search_directive_match:
                 remaining_text_to_check = commands_str_raw[cursor:].strip()
                 if remaining_text_to_check and not remaining_text_to_check.startswith("#"):
-                    self._log(f"解析提示：在剩余文本中未找到更多 '{search_keyword_literal}{START_DELIMITER}' 指令。光标: {cursor}。")
+                    line, column = _line_column(commands_str_raw, cursor)
+                    self._log(f"解析提示：在剩余文本中未找到更多 '{search_keyword_literal}{START_DELIMITER}' 指令。光标: {cursor} (第 {line} 行第 {column} 列)。")
                 break 
-            cursor_after_search_directive = cursor + search_directive_match.end()
+            cursor_after_search_directive = search_directive_match.end()
             search_val_str, cursor_after_search_val = self._extract_delimited_content(
                 commands_str_raw, cursor_after_search_directive, START_DELIMITER, END_DELIMITER
             ) # Note: _extract_delimited_content expects offset to be AFTER opening delimiter, but current regex gives end of 《
@@ -467,11 +481,12 @@ class CodeModifierApp:
                 self._log(f"错误：未能正确解析 '{search_keyword_literal}' 由 '{START_DELIMITER}{END_DELIMITER}' 包裹的内容。")
                 break 
             
-            replace_directive_match = re.search(re.escape(replace_keyword_literal) + r"\s*" + re.escape(START_DELIMITER), commands_str_raw[cursor_after_search_val:])
+            replace_directive_match = _REPLACE_DIRECTIVE_RE.search(commands_str_raw, cursor_after_search_val)
             if not replace_directive_match:
-                self._log(f"错误：在 '{search_keyword_literal}' 内容之后未找到 '{replace_keyword_literal}{START_DELIMITER}' 指令。光标: {cursor_after_search_val}")
+                line, column = _line_column(commands_str_raw, cursor_after_search_val)
+                self._log(f"错误：在 '{search_keyword_literal}' 内容之后未找到 '{replace_keyword_literal}{START_DELIMITER}' 指令。光标: {cursor_after_search_val} (第 {line} 行第 {column} 列)")
                 break 
-            cursor_before_replace_val_content = cursor_after_search_val + replace_directive_match.end()
+            cursor_before_replace_val_content = replace_directive_match.end()
             replace_val_str, cursor_after_replace_val = self._extract_delimited_content(
                 commands_str_raw, cursor_before_replace_val_content, START_DELIMITER, END_DELIMITER
             )
@@ -498,7 +513,11 @@ class CodeModifierApp:
 
         self._log(f"成功解析 {len(parsed_commands)} 个 search/replace 替换对。开始处理...")
 
-        current_code = original_code
+        document = PieceTable(original_code)
+        exact_engine = _ExactMatchEngine(document, [search_val for search_val, _ in parsed_commands])
+        # Normalized line index for round 2 (whitespace runs removed, as in _normalize_text_block). After a
+        # replacement bumps document.version only the rewritten lines are renormalized; rebuilt when that fails.
+        line_index = None
         pair_count = 0
         total_primary_replacements = 0
         total_secondary_replacements = 0
@@ -513,21 +532,24 @@ class CodeModifierApp:
             self._log(f"Search (content): '{log_search_val_display}'")
             self._log(f"Replace (content): '{log_replace_val_display}'")
             
-            initial_occurrences = current_code.count(search_val)
+            initial_occurrences = exact_engine.replace_all(search_val, replace_val)
             if initial_occurrences > 0:
-                current_code = current_code.replace(search_val, replace_val)
                 total_primary_replacements += initial_occurrences
                 self._log(f"执行替换 (第1轮 精确匹配): 找到并替换了 {initial_occurrences} 处。")
             else:
                 self._log(f"第1轮 精确匹配: 未找到 search 字符串。尝试第2轮宽松匹配...")
-                processed_code_round2, round_2_replacements_count = self._replace_whitespace_agnostic(current_code, search_val, replace_val)
+                if line_index is None or (line_index.version != document.version and line_index.update(document) is None):
+                    line_index = _NormalizedLineIndex.for_document(document, whitespace_replacement='')
+                round_2_edits = self._whitespace_agnostic_edits(line_index, search_val, replace_val)
+                round_2_replacements_count = len(round_2_edits)
                 if round_2_replacements_count > 0:
-                    current_code = processed_code_round2
+                    document.apply_edits(round_2_edits)
                     total_secondary_replacements += round_2_replacements_count
                     # Log for individual replacements is now inside _replace_whitespace_agnostic
                 else:
                     self._log(f"  第2轮 宽松匹配: 也未找到匹配项。此对未执行任何替换。")
 
+        current_code = document.text()
         self.modified_code_text.insert(tk.END, current_code)
         if current_code and not current_code.endswith('\n'):
             self.modified_code_text.insert(tk.END, '\n')